@@ -13,6 +13,7 @@ else:
 from optparse import make_option
 from django.test.runner import DiscoverRunner
 
+from .report import TracebackOptions
 from .runner import HtmlTestRunner as BaseHtmlTestRunner
 
 __all__ = ['HtmlTestRunner']
@@ -40,6 +41,15 @@ class HtmlTestRunner(DiscoverRunner):
                 '--html-test-link', dest="html_test_link",
                 action="callback", callback=vararg_callback,
                 help="Add link"),
+            make_option(
+                '--html-test-shared-assets', action='store_true',
+                default=False,
+                help="Write css and javascript once instead of inlining them "
+                "in every page"),
+            make_option(
+                '--html-test-fragment-length', type='int', default=50,
+                help="Number of source lines shown around each traceback "
+                "line"),
         )
     else:
         # Maybe django >= 1.8
@@ -52,6 +62,15 @@ class HtmlTestRunner(DiscoverRunner):
             parser.add_argument(
                 '--html-test-link', nargs='*',
                 help="Add link")
+            parser.add_argument(
+                '--html-test-shared-assets', action='store_true',
+                default=False,
+                help="Write css and javascript once instead of inlining them "
+                "in every page")
+            parser.add_argument(
+                '--html-test-fragment-length', type=int, default=50,
+                help="Number of source lines shown around each traceback "
+                "line")
 
     def __init__(self, **options):
         def test_runner(*args, **kwargs):
@@ -59,6 +78,11 @@ class HtmlTestRunner(DiscoverRunner):
                 *args,
                 html_path=pathlib.Path(options.pop("html_test_path")),
                 links=options.pop("html_test_link"),
+                shared_assets=options.pop("html_test_shared_assets", False),
+                traceback_options=TracebackOptions(
+                    fragment_length=options.pop(
+                        "html_test_fragment_length", 50),
+                ),
                 **kwargs
             )
 
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import six
+import sys
 
 if six.PY2:
     import pathlib2 as pathlib
@@ -11,6 +12,10 @@ from .runner import HtmlTestRunner
 
 
 def main():
+    if sys.argv[1:2] == ["serve"]:
+        from .server import main as serve
+
+        return serve(sys.argv[2:])
     runner = HtmlTestRunner(html_path=pathlib.Path("html"))
     TestProgram(module=None, testRunner=runner)
 
@@ -9,6 +9,8 @@ else:
 
 from nose.plugins import Plugin
 
+from .report import TracebackOptions
+from .report import render_policies
 from .runner import ResultMixIn
 
 
@@ -29,12 +31,106 @@ class HtmlTestNosePlugin(ResultMixIn, Plugin):
         parser.add_option('--html-test-path',
                           default='html',
                           help="Output directory for html test report")
+        parser.add_option('--html-test-shared-assets',
+                          action='store_true', default=False,
+                          help="Write css and javascript once instead of "
+                          "inlining them in every page")
+        parser.add_option('--html-test-workers',
+                          type='int', default=0,
+                          help="Number of background workers rendering the "
+                          "test pages")
+        parser.add_option('--html-test-worker-type',
+                          type='choice', choices=['thread', 'process'],
+                          default='thread',
+                          help="Kind of background workers rendering the "
+                          "test pages")
+        parser.add_option('--html-test-streaming-index',
+                          action='store_true', default=False,
+                          help="Write the index on disk as tests finish "
+                          "instead of keeping it in memory")
+        parser.add_option('--html-test-fragment-length',
+                          type='int', default=50,
+                          help="Number of source lines shown around each "
+                          "traceback line")
+        parser.add_option('--html-test-full-highlight',
+                          action='store_true', default=False,
+                          help="Highlight whole source files of tracebacks "
+                          "instead of a window around the traceback line")
+        parser.add_option('--html-test-compare-workers',
+                          type='int', default=None,
+                          help="Maximum number of concurrent image "
+                          "comparisons, the number of cpus by default")
+        parser.add_option('--html-test-compare-backend',
+                          type='choice',
+                          choices=['auto', 'imagemagick', 'numpy'],
+                          default='auto',
+                          help="Image comparison method, ImageMagick if "
+                          "installed by default")
+        parser.add_option('--html-test-compare-tolerance',
+                          type='float', default=0,
+                          help="Ignored difference of image channels, as a "
+                          "fraction of the channel range")
+        parser.add_option('--html-test-thumbnail-size',
+                          type='int', default=320,
+                          help="Size in pixels of the image thumbnails, 0 "
+                          "to show full images")
+        parser.add_option('--html-test-thumbnail-format',
+                          type='choice', choices=['png', 'webp'],
+                          default='png',
+                          help="Image format of the thumbnails")
+        parser.add_option('--html-test-console-max-size',
+                          type='int', default=1024 * 1024,
+                          help="Size in bytes of the console shown in test "
+                          "pages, beyond which only its head and tail are "
+                          "shown with a link to the whole console")
+        parser.add_option('--html-test-max-log-records',
+                          type='int', default=10000,
+                          help="Maximum number of log records kept by test, "
+                          "the first and the last ones (0 for no limit)")
+        parser.add_option('--html-test-bundle',
+                          action='store_true', default=False,
+                          help="Write the report in a single zip file, "
+                          "<path>.zip, to be browsed with `html-test serve`")
+        parser.add_option('--html-test-render-on-demand',
+                          action='store_true', default=False,
+                          help="Only write the data of the test pages, "
+                          "rendered when browsed with `html-test serve`")
+        parser.add_option('--html-test-render-policy',
+                          type='choice', choices=list(render_policies),
+                          default='all',
+                          help="Tests whose page is rendered: all, failures "
+                          "and tests with console, logs, images or files, "
+                          "or failures only")
+        parser.add_option('--html-test-profile',
+                          default=None,
+                          help="Write a cProfile dump of the report "
+                          "generation in this file")
 
     def configure(self, options, conf):
         super(HtmlTestNosePlugin, self).configure(options, conf)
         if not self.enabled:
             return
-        self.setup(pathlib.Path(options.html_test_path))
+        traceback_options = TracebackOptions(
+            fragment_length=options.html_test_fragment_length,
+            windowed=not options.html_test_full_highlight,
+        )
+        self.setup(pathlib.Path(options.html_test_path),
+                   traceback_options=traceback_options,
+                   console_max_size=options.html_test_console_max_size,
+                   max_log_records=options.html_test_max_log_records,
+                   shared_assets=options.html_test_shared_assets,
+                   render_workers=options.html_test_workers,
+                   render_pool=options.html_test_worker_type,
+                   streaming_index=options.html_test_streaming_index,
+                   compare_workers=options.html_test_compare_workers,
+                   compare_backend=options.html_test_compare_backend,
+                   compare_tolerance=options.html_test_compare_tolerance,
+                   thumbnail_size=options.html_test_thumbnail_size,
+                   thumbnail_format=options.html_test_thumbnail_format,
+                   profile=options.html_test_profile,
+                   bundle=options.html_test_bundle,
+                   render_on_demand=options.html_test_render_on_demand,
+                   render_policy=options.html_test_render_policy)
 
     def finalize(self, result):
         self.make_report()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Destinations of the report files: a directory, or a zip bundle.
+"""
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+
+import six
+
+if six.PY2:
+    import pathlib2 as pathlib
+else:
+    import pathlib
+
+
+class DirectoryOutput(object):
+    """
+    Report written in the directory `path`.
+
+    `work_path` is the directory of the files needed on disk while the report
+    is written (attachments, index records), the report directory itself.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.work_path = path
+        path.mkdir(exist_ok=True, parents=True)
+
+    def write(self, name, data):
+        """
+        Write the file `name` with `data` bytes.
+        """
+        path = self.path / name
+        if not path.parent.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as outfile:
+            outfile.write(data)
+
+    @contextlib.contextmanager
+    def open(self, name):
+        """
+        Context manager returning the binary file object of the file `name`.
+        """
+        path = self.path / name
+        if not path.parent.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as outfile:
+            yield outfile
+
+    def size(self, name):
+        """
+        Return the size in bytes of the file `name`.
+        """
+        return (self.path / name).stat().st_size
+
+    def remove_tree(self, name):
+        """
+        Remove the directory `name` of the report.
+        """
+        path = self.path / name
+        if path.exists():
+            shutil.rmtree(str(path))
+
+    def add_work_files(self, name):
+        """
+        Add the files of the directory `name` of `work_path` to the report.
+        """
+
+    def close(self):
+        pass
+
+
+class ZipOutput(object):
+    """
+    Report written in the zip file `path`, as deflated entries.
+
+    Files needed on disk while the report is written (attachments, index
+    records) are in the directory `work_path`, and added to the bundle by
+    `add_work_files`.
+    """
+
+    def __init__(self, path, work_path):
+        self.path = path
+        self.work_path = work_path
+        work_path.mkdir(exist_ok=True, parents=True)
+        if not path.parent.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self._zip = zipfile.ZipFile(
+            str(path), "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def write(self, name, data):
+        name = str(name)
+        with self._lock:
+            if name in self._names:
+                return
+            self._names.add(name)
+            self._zip.writestr(name, data)
+
+    @contextlib.contextmanager
+    def open(self, name):
+        # Entries written by several file objects at once are written in
+        # temporary files first.
+        fd, tmp = tempfile.mkstemp(dir=str(self.work_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as outfile:
+                yield outfile
+            self._write_file(str(name), tmp)
+        finally:
+            os.remove(tmp)
+
+    def _write_file(self, name, src):
+        with self._lock:
+            if name in self._names:
+                return
+            self._names.add(name)
+            self._zip.write(src, name)
+
+    def size(self, name):
+        with self._lock:
+            return self._zip.getinfo(str(name)).file_size
+
+    def remove_tree(self, name):
+        """
+        Nothing to remove in a new bundle.
+        """
+
+    def add_work_files(self, name):
+        root = self.work_path / name
+        if not root.exists():
+            return
+        for path in sorted(root.rglob("*")):
+            if path.is_file() and path.suffix != ".tmp":
+                self._write_file(
+                    path.relative_to(self.work_path).as_posix(), str(path))
+
+    def add_bundle(self, path):
+        """
+        Add the entries of the zip bundle `path`.
+        """
+        with zipfile.ZipFile(str(path)) as bundle:
+            for name in bundle.namelist():
+                self.write(name, bundle.read(name))
+
+    def close(self):
+        with self._lock:
+            self._zip.close()
+
+
+def bundle_path(html_path):
+    """
+    Return the path of the zip bundle of the report `html_path`.
+    """
+    return pathlib.Path(str(html_path) + ".zip")
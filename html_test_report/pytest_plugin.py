@@ -11,10 +11,14 @@ else:
 
 from _pytest.outcomes import Skipped
 
+from .report import ConsoleCapture
 from .report import ImageResult
+from .report import LogCollector
 from .report import TestCaseReport
 from .report import TestIndexRoot
 from .report import TracebackHandler
+from .report import TracebackOptions
+from .report import render_policies
 
 
 def pytest_addoption(parser):
@@ -31,6 +35,116 @@ def pytest_addoption(parser):
         help="Output directory for html test report",
     )
     group.addoption("--html-test-link", nargs="*", help="Add link")
+    group.addoption(
+        "--html-test-shared-assets",
+        default=False,
+        action="store_true",
+        help="Write css and javascript once instead of inlining them in every page",
+    )
+    group.addoption(
+        "--html-test-workers",
+        default=0,
+        type=int,
+        help="Number of background workers rendering the test pages",
+    )
+    group.addoption(
+        "--html-test-worker-type",
+        default="thread",
+        choices=("thread", "process"),
+        help="Kind of background workers rendering the test pages",
+    )
+    group.addoption(
+        "--html-test-streaming-index",
+        default=False,
+        action="store_true",
+        help="Write the index on disk as tests finish instead of keeping it "
+        "in memory",
+    )
+    group.addoption(
+        "--html-test-fragment-length",
+        default=50,
+        type=int,
+        help="Number of source lines shown around each traceback line",
+    )
+    group.addoption(
+        "--html-test-full-highlight",
+        default=False,
+        action="store_true",
+        help="Highlight whole source files of tracebacks instead of a window "
+        "around the traceback line",
+    )
+    group.addoption(
+        "--html-test-compare-workers",
+        default=None,
+        type=int,
+        help="Maximum number of concurrent image comparisons, the number of "
+        "cpus by default",
+    )
+    group.addoption(
+        "--html-test-compare-backend",
+        default="auto",
+        choices=("auto", "imagemagick", "numpy"),
+        help="Image comparison method, ImageMagick if installed by default",
+    )
+    group.addoption(
+        "--html-test-compare-tolerance",
+        default=0,
+        type=float,
+        help="Ignored difference of image channels, as a fraction of the "
+        "channel range",
+    )
+    group.addoption(
+        "--html-test-thumbnail-size",
+        default=320,
+        type=int,
+        help="Size in pixels of the image thumbnails, 0 to show full images",
+    )
+    group.addoption(
+        "--html-test-thumbnail-format",
+        default="png",
+        choices=("png", "webp"),
+        help="Image format of the thumbnails",
+    )
+    group.addoption(
+        "--html-test-console-max-size",
+        default=1024 * 1024,
+        type=int,
+        help="Size in bytes of the console shown in test pages, beyond which "
+        "only its head and tail are shown with a link to the whole console",
+    )
+    group.addoption(
+        "--html-test-max-log-records",
+        default=10000,
+        type=int,
+        help="Maximum number of log records kept by test, the first and the "
+        "last ones (0 for no limit)",
+    )
+    group.addoption(
+        "--html-test-bundle",
+        default=False,
+        action="store_true",
+        help="Write the report in a single zip file, <path>.zip, to be "
+        "browsed with `html-test serve`",
+    )
+    group.addoption(
+        "--html-test-render-on-demand",
+        default=False,
+        action="store_true",
+        help="Only write the data of the test pages, rendered when browsed "
+        "with `html-test serve`",
+    )
+    group.addoption(
+        "--html-test-render-policy",
+        default="all",
+        choices=render_policies,
+        help="Tests whose page is rendered: all, failures and tests with "
+        "console, logs, images or files, or failures only",
+    )
+    group.addoption(
+        "--html-test-profile",
+        default=None,
+        help="Write a cProfile dump of the report generation in this file",
+    )
 
 
 @pytest.hookimpl(trylast=True)
@@ -40,18 +154,23 @@ def pytest_configure(config):
         config.pluginmanager.register(HtmlTestPlugin(config), "html-test")
 
 
-class TestLogHandler(logging.Handler):
+class TestLogHandler(LogCollector):
 
-    def __init__(self, html_path):
+    def __init__(self, html_path, comparator=None, store=None,
+                 max_records=10000):
         """
         Init TestLogHandler
 
         Args:
             html_path: Location to save the test report
+            comparator: `ImageComparator` running image comparisons
+            store: `AttachmentStore` of the images
+            max_records: Maximum number of log records kept
         """
-        super(TestLogHandler, self).__init__(level=logging.DEBUG)
+        super(TestLogHandler, self).__init__(max_records)
         self.html_path = html_path
-        self.records = []
+        self.comparator = comparator
+        self.store = store
         self.images = []
 
     def emit(self, record):
@@ -60,30 +179,63 @@ class TestLogHandler(logging.Handler):
             try:
                 result = image_data.get("result")
                 expected = image_data.get("expected")
+                img_type = image_data.get("type")
             except Exception as e:
                 try:
                     logging.getLogger("html-test").error("Fail to add image: %s", e)
                 except Exception:
                     pass
-            self.images.append(ImageResult(self.html_path, result, expected))
-        self.records.append((record.name, record.levelname, self.format(record)))
+            self.images.append(
+                ImageResult(self.html_path, result, expected, self.comparator,
+                            self.store, img_type))
+        super(TestLogHandler, self).emit(record)
 
 
 class HtmlTestPlugin(object):
+    """
+    With pytest-xdist, each worker renders its test pages and writes an index
+    shard, merged by the controller in the final report.
+    """
 
     def __init__(self, config):
         self.html_path = pathlib.Path(config.getoption("html_test_path"))
+        workerinput = getattr(config, "workerinput", None)
+        self.worker_id = workerinput["workerid"] if workerinput else None
         self.index = TestIndexRoot(
             self.html_path,
             {
                 "links": config.getoption("html_test_link"),
             },
+            shared_assets=config.getoption("html_test_shared_assets"),
+            render_workers=config.getoption("html_test_workers"),
+            render_pool=config.getoption("html_test_worker_type"),
+            streaming_index=config.getoption("html_test_streaming_index"),
+            shard=self.worker_id,
+            compare_workers=config.getoption("html_test_compare_workers"),
+            compare_backend=config.getoption("html_test_compare_backend"),
+            compare_tolerance=config.getoption("html_test_compare_tolerance"),
+            thumbnail_size=config.getoption("html_test_thumbnail_size"),
+            thumbnail_format=config.getoption("html_test_thumbnail_format"),
+            profile=config.getoption("html_test_profile"),
+            bundle=config.getoption("html_test_bundle"),
+            render_on_demand=config.getoption("html_test_render_on_demand"),
+            render_policy=config.getoption("html_test_render_policy"),
+        )
+        # Summary of the report, shown by the terminal reporter.
+        self.summary = []
+        self.console_max_size = config.getoption("html_test_console_max_size")
+        self.max_log_records = config.getoption("html_test_max_log_records")
+        self.traceback_options = TracebackOptions(
+            fragment_length=config.getoption("html_test_fragment_length"),
+            windowed=not config.getoption("html_test_full_highlight"),
         )
 
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_call(self, item):
         root = logging.getLogger()
-        handler = TestLogHandler(self.html_path)
+        handler = TestLogHandler(
+            self.html_path, self.index.image_comparator, self.index.attachments,
+            self.max_log_records)
         old_handlers = root.handlers
         old_level = root.level
         try:
@@ -98,6 +250,17 @@ class HtmlTestPlugin(object):
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_makereport(self, item, call):
         yield
+        # Test phases durations, the report being added after teardown.
+        if not hasattr(item, "_html_test_phases"):
+            item._html_test_phases = []
+        item._html_test_phases.append((call.when, call.stop - call.start))
+        if call.when == "teardown":
+            test_report = getattr(item, "_html_test_report", None)
+            if test_report is not None:
+                del item._html_test_report
+                test_report.set_phases(item._html_test_phases)
+                self.index.append(test_report)
+            return
         if call.when != "call":
             return
 
@@ -115,7 +278,8 @@ class HtmlTestPlugin(object):
 
         if call.excinfo:
             tracebacks = TracebackHandler(
-                (call.excinfo.type, call.excinfo.value, call.excinfo.tb)
+                (call.excinfo.type, call.excinfo.value, call.excinfo.tb),
+                self.traceback_options,
             )
         else:
             tracebacks = None
@@ -129,22 +293,39 @@ class HtmlTestPlugin(object):
             doc_class = ""
 
         sections = {x[1]: x[2] for x in item._report_sections if x[0] == "call"}
-
-        self.index.append(
-            TestCaseReport(
-                name=name,
-                status=status,
-                doc_class=doc_class,
-                doc_test=doc_test,
-                console="stdout:\n%s\nstderr:\n%s"
-                % (sections.get("stdout", ""), sections.get("stderr", "")),
-                logs=item._log_handler.records,
-                images=item._log_handler.images,
-                tracebacks=tracebacks,
+        console = console_file = None
+        if sections.get("stdout") or sections.get("stderr"):
+            capture = ConsoleCapture(self.console_max_size)
+            capture.write(
+                "stdout:\n%s\nstderr:\n%s"
+                % (sections.get("stdout", ""), sections.get("stderr", ""))
             )
+            console, console_file = capture.get_console(self.index.attachments)
+            capture.close()
+
+        item._html_test_report = TestCaseReport(
+            name=name,
+            status=status,
+            doc_class=doc_class,
+            doc_test=doc_test,
+            console=console,
+            console_file=console_file,
+            logs=item._log_handler.records,
+            logs_dropped=item._log_handler.dropped,
+            images=item._log_handler.images,
+            tracebacks=tracebacks,
         )
 
-    @pytest.hookimpl(hookwrapper=True)
+    @pytest.hookimpl(tryfirst=True)
     def pytest_sessionfinish(self, session):
-        yield
-        self.index.make_report()
+        # Not a hook wrapper: xdist workers tell the controller they are
+        # finished after the inner hooks, the shard must be written before.
+        if self.worker_id is not None:
+            self.index.write_shard()
+        else:
+            self.index.merge_shards()
+            self.index.make_report(self.summary.append)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        for line in self.summary:
+            terminalreporter.write_line(line)
@@ -1,31 +1,55 @@
 # -*- coding: utf-8 -*-
+import bisect
 import codecs
 import collections
 import datetime
+import functools
+import hashlib
+import heapq
+import itertools
 import json
 import logging
 import magic
+import multiprocessing
 import os
-import pkg_resources
 import pprint
 import re
+import shutil
 import six
 import socket
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import tokenize
 import uuid
+import warnings
 
 if six.PY2:
     import pathlib2 as pathlib
 else:
     import pathlib
 
-from jinja2 import Template
+from six.moves import intern
+from six.moves import reprlib
+from six.moves.urllib.parse import quote
+
+from jinja2 import ChoiceLoader
+from jinja2 import DictLoader
+from jinja2 import Environment
+from jinja2 import FileSystemBytecodeCache
+from jinja2 import PackageLoader
 from pygments import highlight
 from pygments import formatters
 from pygments import lexers
 
 from .color_text import red, yellow, green
+from .output import DirectoryOutput
+from .output import ZipOutput
+from .output import bundle_path
+from .stats import clock
+from .stats import stats
 
 
 # Default stdout
@@ -43,6 +67,57 @@ status_dict = {
 pygments_css = formatters.HtmlFormatter().get_style_defs()
 
 
+# Templates registered with `register_template`, looked up before the
+# templates shipped with the package.
+_custom_templates = {}
+_template_env = None
+_template_bytecode_dir = None
+
+
+def register_template(name, source):
+    """
+    Register a custom template `name`, overriding the package template with
+    the same name if any.
+    """
+    _custom_templates[name] = source
+    if _template_env is not None:
+        _template_env.cache.clear()
+
+
+def set_template_bytecode_cache(directory):
+    """
+    Store compiled templates in `directory`, so they are reused between
+    sessions. Must be called before the first template is loaded.
+    """
+    global _template_env, _template_bytecode_dir
+    _template_bytecode_dir = directory
+    _template_env = None
+
+
+def get_template(name):
+    """
+    Return the template `name`, compiled once per session.
+    """
+    global _template_env
+    if _template_env is None:
+        bytecode_cache = None
+        if _template_bytecode_dir is not None:
+            if not os.path.isdir(str(_template_bytecode_dir)):
+                os.makedirs(str(_template_bytecode_dir))
+            bytecode_cache = FileSystemBytecodeCache(str(_template_bytecode_dir))
+        _template_env = Environment(
+            loader=ChoiceLoader(
+                [
+                    DictLoader(_custom_templates),
+                    PackageLoader("html_test_report", "templates"),
+                ]
+            ),
+            bytecode_cache=bytecode_cache,
+            auto_reload=False,
+        )
+    return _template_env.get_template(name)
+
+
 def safe_text(s):
     if not s:
         return six.u("")
@@ -65,13 +140,35 @@ def safe_text(s):
         return six.u(e)
 
 
-def get_img_ext(data):
+# Shared libmagic handle, created on first use.
+_magic = None
+_magic_lock = threading.Lock()
+
+# Size of the data prefix used to detect the type of attachments.
+magic_header_size = 8192
+
+
+def get_mime_type(data):
+    """
+    Return the mime type of `data`, guessed from its first bytes.
     """
-    Return extension of an image.
+    global _magic
+    if _magic is None:
+        with _magic_lock:
+            if _magic is None:
+                _magic = magic.Magic(mime=True)
+    return _magic.from_buffer(data[:magic_header_size])
+
+
+def get_img_ext(data, img_type=None):
+    """
+    Return extension of an image, from its type ("png" or "image/png") if
+    known.
     """
     try:
-        mg = magic.Magic(mime=True)
-        mime = mg.from_buffer(data)
+        mime = img_type or get_mime_type(data)
+        if "/" not in mime:
+            mime = "image/" + mime
         typ, ext = mime.split("/")
     except Exception as e:
         print("Fail to get image type: %s" % e)
@@ -80,11 +177,101 @@ def get_img_ext(data):
         return ext
 
 
+# Linux ioctl cloning a file on copy on write file systems.
+FICLONE = 0x40049409
+
+
+def copy_file(src, dst):
+    """
+    Copy the file `src` to `dst`, sharing blocks of the file if the file
+    system supports it.
+    """
+    try:
+        import fcntl
+
+        with open(src, "rb") as infile, open(dst, "wb") as outfile:
+            fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+        return
+    except (ImportError, IOError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+
+
+class LogCollector(logging.Handler):
+    """
+    Logging handler keeping the records of a test in memory, as tuples
+    `(logger, level, message, created, pathname, lineno)`.
+
+    At most `max_records` records are kept (no limit with 0): the first and
+    the last ones, `dropped` being the number of records in between.
+    """
+
+    def __init__(self, max_records=10000, level=logging.DEBUG):
+        super(LogCollector, self).__init__(level=level)
+        self.max_records = max_records
+        self.dropped = 0
+        self._head = []
+        if max_records:
+            self._head_size = max_records // 2
+            self._tail = collections.deque(maxlen=max_records - self._head_size)
+        else:
+            self._head_size = None
+            self._tail = collections.deque()
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+        except Exception as e:
+            msg = "Invalid log record: %s" % e
+        entry = (
+            record.name, record.levelname, msg, record.created,
+            record.pathname, record.lineno,
+        )
+        if self._head_size is None or len(self._head) < self._head_size:
+            self._head.append(entry)
+            return
+        if len(self._tail) == self._tail.maxlen:
+            self.dropped += 1
+        self._tail.append(entry)
+
+    @property
+    def records(self):
+        return self._head + list(self._tail)
+
+
+def log_entry(entry):
+    """
+    Return the log entry shown in test pages, `(logger, level, message,
+    time, location, path)`, from a `LogCollector` record or a `(logger,
+    level, message)` tuple.
+    """
+    logger, level, msg = entry[:3]
+    if len(entry) < 6:
+        return (logger, level, safe_text(msg), None, None, None)
+    created, pathname, lineno = entry[3:6]
+    timestamp = time.strftime("%H:%M:%S", time.localtime(created))
+    return (
+        logger, level, safe_text(msg),
+        "%s.%03d" % (timestamp, int(created * 1000) % 1000),
+        "%s:%s" % (os.path.basename(pathname), lineno),
+        safe_text(pathname),
+    )
+
+
 class TestFormatter(logging.Formatter):
     """
     Format log entry as json (logger, level, message)
+
+    Deprecated: use `LogCollector`, which keeps log records without
+    formatting them.
     """
 
+    def __init__(self, *args, **kwargs):
+        warnings.warn(
+            "TestFormatter is deprecated, use LogCollector",
+            DeprecationWarning, stacklevel=2)
+        super(TestFormatter, self).__init__(*args, **kwargs)
+
     def format(self, record):
         try:
             if record.args:
@@ -97,23 +284,390 @@ class TestFormatter(logging.Formatter):
         return json.dumps((record.name, record.levelname, msg))
 
 
+def find_executable(name):
+    """
+    Return the path of the executable `name` found in PATH, or None.
+    """
+    for directory in os.environ.get("PATH", "").split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+
+
+# Result of an image comparison: normalized RMSE, and normalized RMSE by
+# channel name when known.
+Comparison = collections.namedtuple("Comparison", ("rmse", "channels"))
+
+
+rmse_regex = re.compile(r"\(([-+.0-9eE]+)\)")
+
+
+def imagemagick_compare(html_path, img1, img2, diff, tolerance=0):
+    """
+    Compare `img1` and `img2` with ImageMagick, writing the diff image in
+    `diff` (paths relative to `html_path`). Return a `Comparison`, or None if
+    the images could not be compared.
+    """
+    cmd = ["compare", "-metric", "rmse"]
+    if tolerance:
+        cmd += ["-fuzz", "%s%%" % (tolerance * 100)]
+    cmd += [str(img1), str(img2), str(diff)]
+    try:
+        process = subprocess.Popen(
+            cmd, cwd=str(html_path), stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        _, err = process.communicate()
+    except Exception as e:
+        stdout.write(
+            "Enable to run ImageMagic compare: %s: %s\n" % (e.__class__.__name__, e)
+        )
+        return None
+    # Exit code is 0 for similar images, 1 for dissimilar images, the
+    # metric being written on stderr as "<rmse> (<normalized rmse>)".
+    match = rmse_regex.search(err.decode("utf-8", "replace"))
+    if process.returncode > 1 or match is None:
+        stdout.write(
+            "Fail to compare images %s and %s: %s\n"
+            % (img1, img2, safe_text(err).strip())
+        )
+        return None
+    return Comparison(float(match.group(1)), None)
+
+
+def numpy_compare(html_path, img1, img2, diff, tolerance=0):
+    """
+    Compare `img1` and `img2` with Pillow and NumPy, writing the diff image
+    in `diff` (paths relative to `html_path`): `img2` faded, with differing
+    pixels in red. Return a `Comparison`.
+
+    Channel differences up to `tolerance` (fraction of the channel range)
+    are ignored. Images of different sizes are compared on their union, the
+    missing part of an image being transparent.
+    """
+    import numpy
+    from PIL import Image
+
+    images = []
+    for img in (img1, img2):
+        with Image.open(str(html_path / img)) as image:
+            images.append(numpy.asarray(image.convert("RGBA"), dtype=numpy.int16))
+    height = max(image.shape[0] for image in images)
+    width = max(image.shape[1] for image in images)
+    for i, image in enumerate(images):
+        if image.shape[:2] != (height, width):
+            padded = numpy.zeros((height, width, 4), dtype=numpy.int16)
+            padded[:image.shape[0], :image.shape[1]] = image
+            images[i] = padded
+    delta = numpy.abs(images[0] - images[1]).astype(numpy.float32)
+    if tolerance:
+        delta[delta <= tolerance * 255] = 0
+    delta /= 255
+    square = delta * delta
+    channels = dict(
+        (name, float(numpy.sqrt(square[:, :, i].mean())))
+        for i, name in enumerate(("red", "green", "blue", "alpha"))
+    )
+    rmse = float(numpy.sqrt(square.mean()))
+    # Diff image in the style of ImageMagick compare.
+    gray = images[1][:, :, :3].mean(axis=2) * 0.2 + 204
+    output = numpy.repeat(gray[:, :, None], 3, axis=2).astype(numpy.uint8)
+    output[delta.max(axis=2) > 0] = (241, 0, 30)
+    Image.fromarray(output, "RGB").save(str(html_path / diff))
+    return Comparison(rmse, channels)
+
+
+def make_thumbnail(html_path, img, size=320, fmt="png"):
+    """
+    Write a thumbnail of `img` fitting in `size` pixels in format `fmt`
+    ("png" or "webp") and return its filename (paths relative to
+    `html_path`). Return None for images already small enough, or without
+    Pillow.
+    """
+    try:
+        from PIL import Image
+        from PIL import features
+    except ImportError:
+        return None
+    if fmt == "webp" and not features.check("webp"):
+        fmt = "png"
+    with Image.open(str(html_path / img)) as image:
+        if max(image.size) <= size:
+            return None
+        filename = pathlib.Path("img", "thumb-%s-%s.%s" % (size, img.stem, fmt))
+        path = html_path / filename
+        if path.exists():
+            return filename
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        tmp = path.with_name("%s.%s.tmp" % (path.name, uuid.uuid4()))
+        image.save(str(tmp), format=fmt.upper())
+    os.rename(str(tmp), str(path))
+    return filename
+
+
+def numpy_available():
+    try:
+        import numpy  # noqa: F401
+        from PIL import Image  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+compare_backends = {
+    "imagemagick": imagemagick_compare,
+    "numpy": numpy_compare,
+}
+
+
+def get_compare_backend(name="auto"):
+    """
+    Return the image comparison function `name`. With "auto", ImageMagick is
+    used when its `compare` command is found, Pillow and NumPy otherwise.
+    """
+    if name == "auto":
+        if find_executable("compare") is None and numpy_available():
+            name = "numpy"
+        else:
+            name = "imagemagick"
+    return compare_backends[name]
+
+
+class ImageComparator(object):
+    """
+    Bounded pool running image comparisons and thumbnails in background.
+
+    `max_workers` is the maximum number of concurrent jobs, the number of
+    cpus by default. `backend` is the comparison method: "auto",
+    "imagemagick" or "numpy" (see `get_compare_backend`). Differences up to
+    `tolerance` (fraction of the channel range) are ignored.
+
+    Thumbnails fit in `thumbnail_size` pixels (no thumbnails with 0), in
+    `thumbnail_format` ("png" or "webp").
+    """
+
+    def __init__(self, max_workers=None, backend="auto", tolerance=0,
+                 thumbnail_size=320, thumbnail_format="png"):
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.backend = get_compare_backend(backend)
+        self.tolerance = tolerance
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_format = thumbnail_format
+        self._executor = None
+        # Jobs by processed images, images being content addressed.
+        self._futures = {}
+
+    def compare(self, html_path, img1, img2, diff):
+        """
+        Compare `img1` and `img2`, returning a `Comparison` or None.
+        """
+        try:
+            with stats.timer("compare"):
+                return self.backend(html_path, img1, img2, diff, self.tolerance)
+        except Exception as e:
+            stdout.write(
+                "Fail to compare images %s and %s: %s: %s\n"
+                % (img1, img2, e.__class__.__name__, e)
+            )
+
+    def thumbnail(self, html_path, img):
+        """
+        Make the thumbnail of `img`, returning its filename or None.
+        """
+        if not self.thumbnail_size or not (html_path / img).exists():
+            return None
+        try:
+            with stats.timer("thumbnail"):
+                return make_thumbnail(
+                    html_path, img, self.thumbnail_size, self.thumbnail_format)
+        except Exception as e:
+            stdout.write(
+                "Fail to make thumbnail of %s: %s: %s\n"
+                % (img, e.__class__.__name__, e)
+            )
+
+    def run(self, html_path, img, expected=None, diff=None):
+        """
+        Compare `img` to `expected` if given, writing `diff`, and make the
+        thumbnail of the resulting image. Return `(comparison, thumbnail)`.
+        """
+        comparison = None
+        if expected is not None:
+            comparison = self.compare(html_path, img, expected, diff)
+            img = diff
+        return comparison, self.thumbnail(html_path, img)
+
+    def submit(self, html_path, img, expected=None, diff=None):
+        """
+        Start `run` in background, returning its future. Images already
+        processed are not processed again.
+        """
+        key = (img, expected, diff)
+        future = self._futures.get(key)
+        if future is None:
+            if self._executor is None:
+                from concurrent import futures
+
+                self._executor = futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+            future = self._executor.submit(
+                self.run, html_path, img, expected, diff)
+            self._futures[key] = future
+        return future
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+class AttachmentStore(object):
+    """
+    Content addressed storage of the attachments of a report.
+
+    Attachments are named by the sha256 of their content, so identical
+    attachments are written once, the names already written in the session
+    being kept in memory.
+    """
+
+    def __init__(self, html_path):
+        self._html_path = html_path
+        self._written = set()
+        self._lock = threading.Lock()
+
+    # Size of the blocks read to hash files.
+    block_size = 1024 * 1024
+
+    def write(self, data, directory, ext=None):
+        """
+        Save `data` in `directory` and return its filename, relative to the
+        report directory.
+        """
+        with stats.timer("attachments"):
+            return self._store(hashlib.sha256(data), directory, ext, data=data)
+
+    def write_stream(self, infile, directory, ext=None):
+        """
+        Save the content of the file object `infile` in `directory` and
+        return its filename, relative to the report directory. The content
+        is copied by blocks.
+        """
+        with stats.timer("attachments"):
+            digest = hashlib.sha256()
+            tmpdir = self._html_path / directory
+            tmpdir.mkdir(exist_ok=True, parents=True)
+            tmp = tmpdir / ("%s.tmp" % uuid.uuid4())
+            with tmp.open("wb") as outfile:
+                while True:
+                    block = infile.read(self.block_size)
+                    if not block:
+                        break
+                    if isinstance(block, six.text_type):
+                        block = block.encode("utf-8")
+                    digest.update(block)
+                    outfile.write(block)
+            return self._store(digest, directory, ext, tmp=tmp)
+
+    def write_file(self, src, directory, ext=None):
+        """
+        Copy the file `src` in `directory` and return its filename, relative
+        to the report directory. The file is not read in memory.
+        """
+        with stats.timer("attachments"):
+            digest = hashlib.sha256()
+            with open(str(src), "rb") as infile:
+                for block in iter(lambda: infile.read(self.block_size), b""):
+                    digest.update(block)
+            return self._store(digest, directory, ext, src=src)
+
+    def _store(self, digest, directory, ext, data=None, src=None, tmp=None):
+        """
+        Store the content of `digest`, from `data`, the file `src` or the
+        temporary file `tmp`.
+        """
+        name = digest.hexdigest()
+        if ext:
+            name += "." + ext
+        filename = pathlib.Path(directory, name)
+        with self._lock:
+            written = filename in self._written
+            self._written.add(filename)
+        path = self._html_path / filename
+        if written or path.exists():
+            if tmp is not None:
+                tmp.unlink()
+            return filename
+        if tmp is not None:
+            stats.add("attachments", size=tmp.stat().st_size, calls=0)
+        elif src is not None:
+            stats.add("attachments", size=os.path.getsize(str(src)), calls=0)
+        else:
+            stats.add("attachments", size=len(data), calls=0)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        if tmp is None:
+            # Write in a temporary file so that a partial file is never
+            # taken as already written.
+            tmp = path.with_name("%s.%s.tmp" % (name, uuid.uuid4()))
+            if src is not None:
+                copy_file(str(src), str(tmp))
+            else:
+                with tmp.open("wb") as outfile:
+                    outfile.write(data)
+        try:
+            os.rename(str(tmp), str(path))
+        except OSError:
+            # Written meanwhile by another process.
+            tmp.unlink()
+            if not path.exists():
+                raise
+        return filename
+
+
 class ImageResult(object):
+    """
+    Image to be add to test report, compared to the `expected` image if
+    any.
+
+    With a `comparator`, the comparison and thumbnails are made in
+    background, `diff`, `rmse` and `thumbnails` being set by `wait`. Images
+    are written in the `store` of the report. Images are bytes or paths, of
+    type `img_type` ("png" or "image/png") if given, detected otherwise.
+    """
 
-    def __init__(self, html_path, result, expected=None):
+    def __init__(self, html_path, result, expected=None, comparator=None,
+                 store=None, img_type=None):
         self._html_path = html_path
-        imgdir = self._html_path / "img"
-        if not imgdir.exists():
-            imgdir.mkdir()
+        self._store = store or AttachmentStore(html_path)
+        self._comparator = None
+        self._img_type = img_type
         self.result = self.write_img(result)
+        self.expected = None
+        self.diff = None
+        self.rmse = None
+        self.channels = None
+        # Thumbnails by image kind ("result", "expected" or "diff").
+        self.thumbnails = {}
+        self._futures = {}
         if expected:
             self.expected = self.write_img(expected)
-            self.rmse = self.compare_rmse(self.result, self.expected)
-        else:
-            self.expected = None
-            self.rmse = None
-
-    def get_random_filename(self, img_type):
-        return pathlib.Path("img", "img-%s.%s" % (str(uuid.uuid4()), img_type))
+        jobs = {"result": (self.result,), "expected": (self.expected,)}
+        if self.result and self.expected:
+            # The diff of two images is named after them.
+            self.diff = pathlib.Path("img", "diff-%s.png" % hashlib.sha256(
+                ("%s %s" % (self.result.name, self.expected.name)).encode("ascii")
+            ).hexdigest())
+            jobs["diff"] = (self.result, self.expected, self.diff)
+        for kind, args in jobs.items():
+            if args[0] is None:
+                continue
+            if comparator is not None:
+                self._futures[kind] = comparator.submit(self._html_path, *args)
+            else:
+                if self._comparator is None:
+                    self._comparator = ImageComparator()
+                self.set_job_result(
+                    kind, self._comparator.run(self._html_path, *args))
 
     def write_img(self, data):
         """
@@ -121,69 +675,180 @@ class ImageResult(object):
         """
         if not data:
             return
+        path = None
         try:
-            if isinstance(data, six.string_types):
+            if isinstance(data, (six.string_types, pathlib.PurePath)):
                 p = pathlib.Path(data)
-                if p.exists():
-                    with p.open("rb") as infile:
-                        data = infile.read()
+                if p.is_file():
+                    path = p
         except Exception:
             pass
-        img_ext = get_img_ext(data)
+        if path is not None:
+            header = None
+            if self._img_type is None:
+                with path.open("rb") as infile:
+                    header = infile.read(magic_header_size)
+            img_ext = get_img_ext(header, self._img_type)
+            if img_ext:
+                return self._store.write_file(path, "img", img_ext)
+            return
+        img_ext = get_img_ext(data, self._img_type)
         if not img_ext:
             return
-        filename = self.get_random_filename(img_ext)
-        with (self._html_path / filename).open("wb") as outfile:
-            outfile.write(data)
-        return filename
+        return self._store.write(data, "img", img_ext)
+
+    def set_job_result(self, kind, job_result):
+        comparison, thumbnail = job_result
+        if thumbnail is not None:
+            self.thumbnails[kind] = thumbnail
+        if kind != "diff":
+            return
+        if comparison is not None:
+            self.rmse, self.channels = comparison
+        if not (self._html_path / self.diff).exists():
+            self.diff = None
 
-    def compare_rmse(self, img1, img2):
+    @property
+    def pending(self):
         """
-        Compute RMSE difference between `img1` and `img2` and return filename
-        for the diff image.
+        Futures of the running jobs.
         """
-        filename = self.get_random_filename("png")
-        cmd = ["compare", "-metric", "rmse", str(img1), str(img2), str(filename)]
-        try:
-            subprocess.call(cmd, cwd=str(self._html_path))
-        except Exception as e:
-            stdout.write(
-                "Enable to run ImageMagic compare: %s: %s\n" % (e.__class__.__name__, e)
-            )
-        if (self._html_path / filename).exists():
-            return filename
+        return list(self._futures.values())
+
+    def wait(self):
+        """
+        Wait for the comparison and thumbnails and set their results.
+        """
+        futures, self._futures = self._futures, {}
+        for kind, future in futures.items():
+            self.set_job_result(kind, future.result())
+        return self
+
+    def __getstate__(self):
+        state = self.wait().__dict__.copy()
+        state["_store"] = None
+        state["_comparator"] = None
+        return state
 
     def to_dict(self):
+        self.wait()
         return {
             "result": self.result,
             "expected": self.expected,
+            "diff": self.diff,
             "rmse": self.rmse,
+            "channels": self.channels,
+            "thumbnails": self.thumbnails,
         }
 
 
 class FileResult(object):
     """
     File to be add to test report.
+
+    `content` is bytes, kept as is, text, a file object or a `pathlib` path,
+    whose content is copied by blocks.
     """
 
-    def __init__(self, html_path, content, title=None, content_type=None):
-        destdir = html_path / "data"
-        if not destdir.exists():
-            destdir.mkdir()
-        self.filename = pathlib.Path("data", "file-%s" % str(uuid.uuid4()))
-        with (html_path / self.filename).open("wb") as outfile:
-            outfile.write(safe_text(content).encode("utf-8"))
-        self.title = safe_text(title) or self.filename.name
+    def __init__(self, html_path, content, title=None, content_type=None,
+                 store=None):
+        store = store or AttachmentStore(html_path)
+        name = None
+        if hasattr(content, "read"):
+            self.filename = store.write_stream(content, "data")
+            name = getattr(content, "name", None)
+        elif isinstance(content, pathlib.PurePath):
+            self.filename = store.write_file(content, "data")
+            name = content.name
+        elif isinstance(content, six.binary_type):
+            self.filename = store.write(content, "data")
+        else:
+            self.filename = store.write(safe_text(content).encode("utf-8"), "data")
+        if not isinstance(name, six.string_types):
+            name = None
+        self.content_type = content_type
+        self.title = (
+            safe_text(title) or (name and os.path.basename(name))
+            or self.filename.name
+        )
 
     def to_dict(self):
-        return {"title": self.title, "filename": self.filename}
+        return {
+            "title": self.title,
+            "filename": self.filename,
+            "content_type": self.content_type,
+        }
+
+
+class ConsoleCapture(object):
+    """
+    File object capturing the console output of a test, kept in memory up to
+    `max_size` bytes and spilled to a temporary file beyond.
+    """
+
+    encoding = "utf-8"
+
+    def __init__(self, max_size=1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_size)
+
+    def write(self, data):
+        if isinstance(data, six.text_type):
+            data = data.encode("utf-8", "replace")
+        self._file.write(data)
+        self.size += len(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        self._file.close()
+
+    def get_console(self, store=None):
+        """
+        Return the console shown in the test page, and the filename of the
+        whole console saved in `store` if not shown in whole. Beyond
+        `max_size`, only the head and the tail of the console are shown.
+        """
+        self._file.seek(0)
+        if self.size <= self.max_size:
+            return self._file.read().decode("utf-8", "replace"), None
+        half = self.max_size // 2
+        head = self._file.read(half)
+        self._file.seek(self.size - half)
+        tail = self._file.read()
+        console = "%s\n\n[... %s bytes not shown ...]\n\n%s" % (
+            head.decode("utf-8", "replace"),
+            self.size - 2 * half,
+            tail.decode("utf-8", "replace"),
+        )
+        filename = None
+        if store is not None:
+            self._file.seek(0)
+            filename = store.write_stream(self._file, "data", "txt")
+        return console, filename
 
 
 class TestCaseReport(object):
     """
     Report for one test.
+
+    The test data is kept in slots, the context of the page template being
+    built by `context` when rendering.
     """
 
+    __slots__ = ("name", "status", "doc_class", "doc_test", "console",
+                 "console_file", "logs", "logs_dropped", "tracebacks", "reason",
+                 "images", "files", "duration", "phases")
+
     def __init__(
         self,
         name,
@@ -196,83 +861,589 @@ class TestCaseReport(object):
         reason=None,
         images=None,
         files=None,
+        duration=None,
+        console_file=None,
+        logs_dropped=0,
+        phases=None,
     ):
         self.name = name
         self.status = status
+        self.doc_class = safe_text(doc_class)
+        self.doc_test = safe_text(doc_test)
+        self.console = safe_text(console)
+        self.console_file = console_file
+        self.logs = tuple(log_entry(entry) for entry in (logs or ()))
+        self.logs_dropped = logs_dropped
+        self.tracebacks = tracebacks
+        self.reason = safe_text(reason)
+        self.images = images
+        self.files = files
+        self.duration = duration
+        # Durations of the test phases, as (phase, duration) pairs.
+        self.phases = ()
+        if phases:
+            self.set_phases(phases)
+
+    @property
+    def context(self):
+        """
+        Context of the page template.
+        """
         try:
-            status_title = status_dict[status][1]
+            status_title = status_dict[self.status][1]
         except KeyError:
             status_title = "unknow"
-        self.context = {
-            "name": six.ensure_text(name),
-            "status": status,
+        return {
+            "name": six.ensure_text(self.name),
+            "status": self.status,
             "status_title": status_title,
-            "doc_class": safe_text(doc_class),
-            "doc_test": safe_text(doc_test),
-            "console": safe_text(console),
-            "logs": [
-                (name, level, safe_text(msg)) for name, level, msg in (logs or ())
-            ],
-            "tracebacks": tracebacks,
-            "reason": safe_text(reason),
-            "images": images,
-            "files": files,
+            "doc_class": self.doc_class,
+            "doc_test": self.doc_test,
+            "console": self.console,
+            "console_file": self.console_file,
+            "logs": self.logs,
+            "logs_dropped": self.logs_dropped,
+            "tracebacks": self.tracebacks,
+            "reason": self.reason,
+            "images": self.images,
+            "files": self.files,
             "pygments_css": pygments_css,
+            "duration": self.duration,
+            "phases": self.phases,
         }
 
-    def render(self, html_path, global_context):
-        self.context.update(global_context)
-        template = Template(
-            pkg_resources.resource_string(
-                "html_test_report", os.path.join("templates", "test-case.html")
-            ).decode("utf-8")
+    def set_phases(self, phases):
+        """
+        Set the durations of the test phases, as (phase, duration) pairs, the
+        duration of the test being their sum.
+        """
+        self.phases = tuple(tuple(x) for x in phases)
+        self.duration = sum(x[1] for x in self.phases)
+
+    @property
+    def filename(self):
+        return self.name + ".html"
+
+    @property
+    def has_attachments(self):
+        """
+        Whether the test has console output, logs, images or files.
+        """
+        return bool(self.console or self.logs or self.images or self.files)
+
+    @property
+    def index_info(self):
+        """
+        Optional informations on the test stored in the index.
+        """
+        info = {}
+        if self.duration is not None:
+            info["duration"] = round(self.duration, 3)
+        rmse = [
+            image.rmse for image in self.images or ()
+            if getattr(image, "rmse", None) is not None
+        ]
+        if rmse:
+            info["rmse"] = max(rmse)
+        return info
+
+    def pending(self):
+        """
+        Return futures of the image comparisons and thumbnails still
+        running.
+        """
+        return [
+            future for image in self.images or ()
+            if isinstance(image, ImageResult)
+            for future in image.pending
+        ]
+
+    def wait(self):
+        """
+        Wait for image comparisons and thumbnails.
+        """
+        for image in self.images or ():
+            if isinstance(image, ImageResult):
+                image.wait()
+        return self
+
+    def snapshot(self):
+        """
+        Make the report picklable, independent of the test frames.
+        """
+        if self.tracebacks:
+            with stats.timer("snapshot"):
+                self.tracebacks.snapshot()
+        return self
+
+    def to_dict(self):
+        """
+        Return the data of the test page, without rendering it.
+        """
+        self.wait()
+        data = dict(
+            (key, getattr(self, key)) for key in (
+                "status", "doc_class", "doc_test", "console", "console_file",
+                "logs", "logs_dropped", "reason", "duration", "phases")
+        )
+        data["name"] = six.ensure_text(self.name)
+        data["tracebacks"] = self.tracebacks and self.tracebacks.to_dict()
+        data["images"] = [
+            image.to_dict() if isinstance(image, ImageResult) else image
+            for image in self.images or ()
+        ]
+        data["files"] = [
+            f.to_dict() if isinstance(f, FileResult) else f
+            for f in self.files or ()
+        ]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Return the report of `to_dict` output `data`, images and files being
+        plain dicts.
+        """
+        report = cls(
+            data["name"], data["status"],
+            doc_class=data["doc_class"],
+            doc_test=data["doc_test"],
+            console=data["console"],
+            console_file=data["console_file"],
+            logs_dropped=data["logs_dropped"],
+            tracebacks=(
+                data["tracebacks"]
+                and TracebackHandler.from_dict(data["tracebacks"])),
+            reason=data["reason"],
+            images=data["images"],
+            files=data["files"],
+            duration=data["duration"],
+            phases=data["phases"],
         )
-        filename = self.name + ".html"
-        with open(str(html_path / filename), "wb") as outfile:
-            report = template.render(self.context)
-            outfile.write(report.encode("utf-8"))
+        report.logs = tuple(tuple(x) for x in data["logs"])
+        return report
+
+    def dumps(self):
+        """
+        Return the data of the test page as json utf-8 bytes.
+        """
+        with stats.timer("data"):
+            data = json.dumps(
+                self.to_dict(), separators=(",", ":"), default=six.text_type
+            ).encode("utf-8")
+        stats.add("data", size=len(data), calls=0)
+        return data
+
+    @classmethod
+    def loads(cls, data):
+        return cls.from_dict(json.loads(data.decode("utf-8")))
+
+    @property
+    def data_filename(self):
+        return "tests/%s.json" % self.name
+
+    def render_page(self, global_context):
+        """
+        Return the page of the test, as utf-8 bytes.
+        """
+        self.wait()
+        context = self.context
+        context.update(global_context)
+        template = get_template("test-case.html")
+        with stats.timer("render"):
+            report = template.render(context).encode("utf-8")
+        stats.add("render", size=len(report), calls=0)
+        return report
+
+    def render(self, output, global_context):
+        """
+        Write the page of the test in `output` and return its filename.
+        """
+        filename = self.filename
+        output.write(filename, self.render_page(global_context))
         return filename
 
 
-class TbFrame(object):
+def render_page_job(render_page, global_context):
     """
-    Expose one frame of a traceback to jinja2.
+    Return the page rendered by `render_page` in a worker process, and the
+    statistics of its rendering, to be merged by the main process.
     """
+    stats.clear()
+    page = render_page(global_context)
+    return page, stats.as_dict()
 
-    CodeLine = collections.namedtuple(
-        'CodeLine', ('lineno', 'code', 'highlight', 'extended'))
-    VarLine = collections.namedtuple('VarLine', ('name', 'value'))
-    coding_regex = re.compile(
-        six.b(r"^[ \t\f]*#.*?coding[:=][ \t]*(?P<coding>[-_.a-zA-Z0-9]+)"))
 
-    def __init__(self, frame, lineno):
-        self.frame = frame
-        self.filename = frame.f_code.co_filename
-        self.lineno = lineno
-        self.name = frame.f_code.co_name
-        self.id = str(uuid.uuid4())
+def highlight_lines(source):
+    """
+    Return the list of html highlighted lines of python `source`.
+    """
+    if source is None:
+        return None
+    lexer = lexers.Python3Lexer(stripnl=False)
+    formatter = formatters.HtmlFormatter(full=False, linenos=False)
+    return [
+        frag[1].rstrip()
+        for frag in formatter._highlight_lines(
+            formatter._format_lines(lexer.get_tokens(source)))
+    ]
+
+
+def lines_size(lines):
+    return sum(len(line) for line in lines)
+
+
+class LRUCache(object):
+    """
+    LRU cache of source lines.
+
+    Memory is bounded by `max_size`, the total size of cached values as
+    returned by `sizeof`.
+    """
+
+    def __init__(self, max_size=32 * 1024 * 1024, sizeof=lines_size):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """
+        Return the value for `key`, calling `compute` on cache miss.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                return entry[0]
+        value = compute()
+        if value is None:
+            return None
+        size = self.sizeof(value)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self._size += size
+            while self._size > self.max_size and len(self._entries) > 1:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._size -= old_size
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+SourceWindow = collections.namedtuple("SourceWindow", ("first", "lines"))
+
+
+# Highlighted lines by source window key.
+highlight_cache = LRUCache()
+# Raw source windows by source window key.
+window_cache = LRUCache(
+    max_size=8 * 1024 * 1024, sizeof=lambda window: lines_size(window.lines))
+
+
+resync_regex = re.compile(
+    r"^(?:@|(?:async[ \t]+)?def[ \t]|class[ \t]|import[ \t]|from[ \t]"
+    r"|if[ \t]|for[ \t]|while[ \t]|try[ \t]*:|with[ \t]"
+    r"|[A-Za-z_][\w.]*[ \t]*=[^=])")
+
+
+def find_resync_line(lines, lineno):
+    """
+    Return the line number of the closest top level statement at or before
+    `lineno`, from which `lines` can be highlighted without the previous
+    lines, or 1 if there is none.
+    """
+    for i in range(lineno, 0, -1):
+        if resync_regex.match(lines[i - 1]):
+            return i
+    return 1
+
+
+# Tokens of the text of strings, spanning several lines.
+string_tokens = frozenset(
+    getattr(tokenize, name) for name in ("STRING", "FSTRING_MIDDLE")
+    if hasattr(tokenize, name))
+
+
+def find_window_end(lines, first, lineno, stop):
+    """
+    Return the last line of the window of `lines` starting at the line
+    `first` and showing the lines up to `stop`, extended to the end of a
+    string spanning `stop`.
+
+    Return None when `lineno` is inside a string once tokenized from `first`,
+    as when `first` is itself inside a multi-line string, or when the lines
+    cannot be tokenized from `first`: highlighting from `first` would be
+    wrong.
+    """
+    readline = functools.partial(next, iter(lines[first - 1:]), "")
+    end = stop
+    try:
+        for token in tokenize.generate_tokens(readline):
+            start_row = token[2][0] + first - 1
+            end_row = token[3][0] + first - 1
+            if start_row > end:
+                break
+            if token[0] in string_tokens:
+                if start_row < lineno <= end_row:
+                    return None
+                end = max(end, end_row)
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    return min(end, len(lines))
+
+
+def find_fragment_lines(lines, first, start, stop):
+    """
+    Return (begin, end): the lines of the window `lines` starting at the line
+    `first` needed to highlight the lines from `start` to `stop`, extended to
+    the start of a string spanning `start` and to the end of a string spanning
+    `stop`.
+    """
+    last = first + len(lines) - 1
+    begin = max(first, start)
+    end = min(stop, last)
+    readline = functools.partial(next, iter(lines), "")
+    try:
+        for token in tokenize.generate_tokens(readline):
+            start_row = token[2][0] + first - 1
+            end_row = token[3][0] + first - 1
+            if start_row > end:
+                break
+            if token[0] in string_tokens:
+                if start_row < begin <= end_row:
+                    begin = start_row
+                end = max(end, end_row)
+    except (tokenize.TokenError, SyntaxError):
+        return first, last
+    return begin, min(end, last)
+
+
+class TracebackOptions(object):
+    """
+    Rendering options of tracebacks.
+
+    Args:
+        fragment_length: Number of source lines shown before and after the
+            line of each frame.
+        windowed: Only highlight a window around the line of each frame,
+            instead of the whole source file.
+        var_max_chars: Maximum length of the representation of one local
+            variable.
+        var_max_depth: Maximum nesting level shown in local variables.
+        var_max_items: Maximum number of items shown for containers.
+        frame_time_budget: Time in seconds allowed to render the local
+            variables of one frame.
+        report_byte_budget: Total size of local variables representation for
+            one test report.
+        highlight_max_chars: Local variables longer than this are not
+            highlighted.
+    """
+
+    def __init__(
+        self,
+        fragment_length=50,
+        windowed=True,
+        var_max_chars=4096,
+        var_max_depth=4,
+        var_max_items=50,
+        frame_time_budget=1.0,
+        report_byte_budget=1024 * 1024,
+        highlight_max_chars=8192,
+    ):
+        self.fragment_length = fragment_length
+        self.windowed = windowed
+        self.var_max_chars = var_max_chars
+        self.var_max_depth = var_max_depth
+        self.var_max_items = var_max_items
+        self.frame_time_budget = frame_time_budget
+        self.report_byte_budget = report_byte_budget
+        self.highlight_max_chars = highlight_max_chars
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
 
-    @staticmethod
-    def get_charset(filename):
-        with open(filename, 'rb') as srcfile:
-            for i in range(2):
-                l = srcfile.readline()
-                m = TbFrame.coding_regex.match(l)
-                if m:
-                    return m.group('coding').decode('ascii')
-        if six.PY2:
-            return u'ascii'
-        else:
-            return u'utf-8'
+
+class SafeRepr(reprlib.Repr):
+    """
+    Representation of values bounded in size and depth.
+
+    `truncated` is set when some part of the value has been left out.
+    """
+
+    containers = (dict, list, tuple, set, frozenset)
+
+    def __init__(self, max_chars, max_depth, max_items):
+        reprlib.Repr.__init__(self)
+        self.maxlevel = max_depth
+        self.maxdict = self.maxlist = self.maxtuple = self.maxset = \
+            self.maxfrozenset = self.maxdeque = self.maxarray = max_items
+        self.maxstring = self.maxlong = self.maxother = max_chars
+        self.max_chars = max_chars
+        self.truncated = False
+
+    def repr(self, x):
+        self.truncated = False
+        s = reprlib.Repr.repr(self, x)
+        if len(s) > self.max_chars:
+            self.truncated = True
+            s = s[:self.max_chars] + "..."
+        return s
+
+    def repr1(self, x, level):
+        try:
+            size = len(x)
+        except Exception:
+            size = 0
+        if size:
+            if isinstance(x, (six.text_type, six.binary_type)):
+                self.truncated |= size > self.maxstring
+            elif level <= 0 or size > self.maxlist:
+                self.truncated = True
+            typename = type(x).__name__
+            if size > self.maxlist and not hasattr(self, "repr_" + typename):
+                # Builtin container subclasses would get a full repr.
+                for base in self.containers:
+                    if isinstance(x, base):
+                        method = getattr(self, "repr_" + base.__name__)
+                        return "%s(%s)" % (typename, method(x, level))
+        return reprlib.Repr.repr1(self, x, level)
+
+    def repr_instance(self, x, level):
+        s = repr(x)
+        if len(s) > self.maxother:
+            self.truncated = True
+            i = max(0, (self.maxother - 3) // 2)
+            j = max(0, self.maxother - 3 - i)
+            s = s[:i] + "..." + s[len(s) - j:]
+        return s
+
+
+class ReprBudget(object):
+    """
+    Remaining size allowed for local variables of one report.
+    """
+
+    def __init__(self, size):
+        self.remaining = size
+
+    def consume(self, size):
+        self.remaining -= size
+
+
+class FrameView(object):
+    """
+    Expose one frame of a traceback to jinja2.
+
+    Subclasses provide the source window and the local variables
+    representation, through `get_code_window` and `iter_var_reprs`.
+    """
+
+    __slots__ = ()
+
+    CodeLine = collections.namedtuple(
+        'CodeLine', ('lineno', 'code', 'highlight', 'extended'))
+    VarLine = collections.namedtuple('VarLine', ('name', 'value', 'truncated'))
+
+    def get_code_window(self):
+        """
+        Return (key, window, error): the `SourceWindow` around the frame
+        line, a key identifying it, or an error message.
+        """
+        raise NotImplementedError
+
+    def iter_var_reprs(self):
+        """
+        Yield (name, text, is_code, truncated) for each local variable.
+        """
+        raise NotImplementedError
 
     @property
     def code_fragment(self):
-        fragment_length = 50
+        fragment_length = self.options.fragment_length
         start = max(1, self.lineno - fragment_length)
         stop = self.lineno + fragment_length
+
+        key, window, error = self.get_code_window()
+        if error is not None:
+            yield self.CodeLine(None, error, True, False)
+            return
+        if window is None:
+            return
+        def compute():
+            with stats.timer("highlight"):
+                return highlight_lines(u"".join(window.lines))
+
+        lines = highlight_cache.get(key, compute)
+
+        last = window.first + len(lines) - 1
+        for lineno in range(max(start, window.first), min(stop, last) + 1):
+            yield self.CodeLine(
+                lineno, lines[lineno - window.first],
+                lineno == self.lineno,
+                lineno <= self.lineno - 2 or lineno >= self.lineno + 2
+            )
+
+    @property
+    def loc_vars(self):
+        lexer_text = lexers.TextLexer()
         lexer = lexers.Python3Lexer(stripnl=False)
         formatter = formatters.HtmlFormatter(full=False, linenos=False)
+        for name, text, is_code, truncated in self.iter_var_reprs():
+            start = clock()
+            if is_code and len(text) <= self.options.highlight_max_chars:
+                value = highlight(text, lexer, formatter)
+            else:
+                value = highlight(text, lexer_text, formatter)
+            stats.add("locals", clock() - start)
+            yield self.VarLine(name, value, truncated)
+
+
+class TbFrame(FrameView):
+    """
+    Frame of a live traceback.
+    """
 
+    coding_regex = re.compile(
+        six.b(r"^[ \t\f]*#.*?coding[:=][ \t]*(?P<coding>[-_.a-zA-Z0-9]+)"))
+
+    def __init__(self, frame, lineno, options=None, budget=None):
+        self.frame = frame
+        self.options = options or TracebackOptions()
+        if budget is None:
+            budget = ReprBudget(self.options.report_byte_budget)
+        self.budget = budget
+        self.filename = frame.f_code.co_filename
+        self.lineno = lineno
+        self.name = frame.f_code.co_name
+        self.id = str(uuid.uuid4())
+
+    @staticmethod
+    def get_charset(filename):
+        with open(filename, 'rb') as srcfile:
+            for i in range(2):
+                l = srcfile.readline()
+                m = TbFrame.coding_regex.match(l)
+                if m:
+                    return m.group('coding').decode('ascii')
+        if six.PY2:
+            return u'ascii'
+        else:
+            return u'utf-8'
+
+    def get_source(self):
+        """
+        Return the source code of the frame module, or None if unavailable.
+        """
         loader = self.frame.f_globals.get('__loader__')
         module_name = self.frame.f_globals.get('__name__') or ''
         source = None
@@ -287,46 +1458,215 @@ class TbFrame(object):
                 with codecs.open(self.filename, 'r', encoding=charset) as infile:
                     source = infile.read()
             except IOError:
-                return
+                pass
+        return source
 
+    def get_source_key(self):
+        """
+        Return a key identifying the current version of the frame source file.
+
+        On disk files are identified by their modification time and size, so
+        the source is only read when not already highlighted. Other sources
+        (zip imports, ...) are identified by a hash of their content.
+        """
+        try:
+            st = os.stat(self.filename)
+        except (OSError, TypeError):
+            source = self.get_source()
+            if source is None:
+                return None, None
+            digest = hashlib.sha1(six.ensure_binary(source, "utf-8")).hexdigest()
+            return (self.filename, digest), source
+        return (self.filename, st.st_mtime, st.st_size), None
+
+    def get_source_lines(self, source):
+        """
+        Return the lines of the source code, without keeping the whole
+        source text.
+        """
+        if source is None:
+            try:
+                charset = self.get_charset(self.filename)
+                with codecs.open(self.filename, 'r', encoding=charset) as infile:
+                    return infile.readlines()
+            except IOError:
+                source = self.get_source()
+                if source is None:
+                    return None
+        return source.splitlines(True)
+
+    def read_window(self, source, start, stop):
+        """
+        Return the `SourceWindow` from `start` to `stop`, extended to the
+        closest top level statement before `start` and to the end of a string
+        spanning `stop`, or of the whole source if this statement is inside a
+        multi-line string.
+        """
+        lines = self.get_source_lines(source)
+        if lines is None or len(lines) < start:
+            return None
+        first = find_resync_line(lines, start)
+        end = find_window_end(lines, first, self.lineno, stop)
+        if end is None:
+            # Resynchronized inside a multi-line string.
+            return self.read_source(source)
+        return SourceWindow(first, lines[first - 1:end])
+
+    def read_source(self, source):
+        """
+        Return the `SourceWindow` of the whole source file.
+        """
+        source = source or self.get_source()
+        if source is None:
+            return None
+        return SourceWindow(1, source.splitlines(True))
+
+    def get_code_window(self):
+        fragment_length = self.options.fragment_length
+        start = max(1, self.lineno - fragment_length)
+        stop = self.lineno + fragment_length
+
+        key, source = self.get_source_key()
+        if key is None:
+            return None, None, None
         try:
-            for lineno, frag in enumerate(
-                    formatter._highlight_lines(
-                        formatter._format_lines(
-                            lexer.get_tokens(source))),
-                    start=1):
-                if lineno >= start:
-                    yield self.CodeLine(
-                        lineno, frag[1].rstrip(),
-                        lineno == self.lineno,
-                        lineno <= self.lineno - 2 or lineno >= self.lineno + 2
-                    )
-                if lineno >= stop:
-                    break
+            if self.options.windowed:
+                key = key + (start, stop)
+                window = window_cache.get(
+                    key, lambda: self.read_window(source, start, stop))
+            else:
+                window = window_cache.get(key, lambda: self.read_source(source))
         except UnicodeDecodeError as e:
-            yield self.CodeLine(None, six.u(str(e)), True, False)
+            return None, None, six.u(str(e))
+        return key, window, None
 
-    @property
-    def loc_vars(self):
-        lexer_text = lexers.TextLexer()
-        lexer = lexers.Python3Lexer(stripnl=False)
-        formatter = formatters.HtmlFormatter(full=False, linenos=False)
+    def format_var(self, value, safe_repr):
+        """
+        Return (text, truncated) for the local variable `value`.
+        """
+        text = safe_repr.repr(value)
+        truncated = safe_repr.truncated
+        if not truncated:
+            # Small enough to be pretty printed.
+            text = pprint.pformat(value, indent=4)
+        return text, truncated
+
+    def iter_var_reprs(self):
+        options = self.options
+        safe_repr = SafeRepr(options.var_max_chars, options.var_max_depth,
+                             options.var_max_items)
+        deadline = time.time() + options.frame_time_budget
         for name, value in sorted(self.frame.f_locals.items()):
+            if self.budget.remaining <= 0:
+                yield name, "<skipped: report size limit reached>", False, True
+                continue
+            if time.time() > deadline:
+                yield name, "<skipped: frame time limit reached>", False, True
+                continue
             try:
-                value = pprint.pformat(value, indent=4)
-                value = highlight(value, lexer, formatter)
+                text, truncated = self.format_var(value, safe_repr)
+                is_code = True
             except Exception as e:
-                value = highlight("%s: %s" % (e.__class__.__name__, str(e)),
-                                  lexer_text, formatter)
-            yield self.VarLine(name, value)
+                text = "%s: %s" % (e.__class__.__name__, str(e))
+                truncated = False
+                is_code = False
+            self.budget.consume(len(text))
+            yield name, text, is_code, truncated
+
+    def snapshot(self):
+        """
+        Return a `FrameSnapshot` of this frame, not referencing the frame.
+        """
+        key, window, error = self.get_code_window()
+        return FrameSnapshot(
+            filename=self.filename,
+            lineno=self.lineno,
+            name=self.name,
+            id=self.id,
+            options=self.options,
+            code_window=(key, window, error),
+            var_reprs=tuple(self.iter_var_reprs()),
+        )
+
+
+class FrameSnapshot(FrameView):
+    """
+    Picklable copy of a frame, with its source window and the representation
+    of its local variables as a tuple of (name, text, is_code, truncated).
+    """
+
+    __slots__ = ("filename", "lineno", "name", "id", "options", "code_window",
+                 "var_reprs")
+
+    def __init__(self, filename, lineno, name, id, options, code_window,
+                 var_reprs):
+        self.filename = filename
+        self.lineno = lineno
+        self.name = name
+        self.id = id
+        self.options = options
+        self.code_window = code_window
+        self.var_reprs = var_reprs
+
+    def get_code_window(self):
+        return self.code_window
+
+    def iter_var_reprs(self):
+        return iter(self.var_reprs)
+
+    def to_dict(self):
+        key, window, error = self.code_window
+        if window is not None:
+            # Only the lines needed to highlight the lines shown are kept,
+            # not the whole window.
+            fragment_length = self.options.fragment_length
+            begin, end = find_fragment_lines(
+                window.lines, window.first,
+                self.lineno - fragment_length, self.lineno + fragment_length)
+            offset = begin - window.first
+            window = (begin, window.lines[offset:offset + end - begin + 1])
+            key = tuple(key) + ("fragment", begin, end)
+        return {
+            "filename": self.filename,
+            "lineno": self.lineno,
+            "name": self.name,
+            "id": self.id,
+            "code_window": (key, window, error),
+            "var_reprs": self.var_reprs,
+        }
+
+    @classmethod
+    def from_dict(cls, data, options):
+        """
+        Return the snapshot of `to_dict` output `data`, rendered with the
+        `TracebackOptions` `options`.
+        """
+        key, window, error = data["code_window"]
+        return cls(
+            filename=data["filename"],
+            lineno=data["lineno"],
+            name=data["name"],
+            id=data["id"],
+            options=options,
+            # Keys of the highlight cache are hashable.
+            code_window=(
+                key and tuple(key), window and SourceWindow(*window), error),
+            var_reprs=tuple(tuple(x) for x in data["var_reprs"]),
+        )
 
 
 class Traceback(object):
     """
     Expose one traceback to jinja2.
+
+    Tracebacks of a `TracebackHandler` are snapshotted when created, so they
+    do not keep the frames and their local variables alive.
     """
 
-    def __init__(self, name, msg, tb):
+    __slots__ = ("name", "title", "description", "tb", "frames", "options",
+                 "budget")
+
+    def __init__(self, name, msg, tb, options=None, budget=None):
         self.name = name
         lines = msg.splitlines()
         self.title = lines[0] if lines else "Unknow"
@@ -335,17 +1675,56 @@ class Traceback(object):
         else:
             self.description = None
         self.tb = tb
+        self.frames = None
+        self.options = options or TracebackOptions()
+        if budget is None:
+            budget = ReprBudget(self.options.report_byte_budget)
+        self.budget = budget
 
     def __iter__(self):
+        if self.frames is not None:
+            for frame in self.frames:
+                yield frame
+            return
         tb = self.tb
         while tb:
-            yield TbFrame(tb.tb_frame, tb.tb_lineno)
+            yield TbFrame(tb.tb_frame, tb.tb_lineno, self.options, self.budget)
             tb = tb.tb_next
 
+    def snapshot(self):
+        """
+        Replace the live traceback by snapshots of its frames.
+        """
+        if self.frames is None:
+            self.frames = [frame.snapshot() for frame in self]
+            self.tb = None
+
+    def to_dict(self):
+        self.snapshot()
+        return {
+            "name": self.name,
+            "title": self.title,
+            "description": self.description,
+            "frames": [frame.to_dict() for frame in self.frames],
+        }
+
+    @classmethod
+    def from_dict(cls, data, options):
+        msg = data["title"]
+        if data["description"] is not None:
+            msg += u"\n" + data["description"]
+        traceback = cls(data["name"], msg, None, options)
+        traceback.frames = [
+            FrameSnapshot.from_dict(frame, options) for frame in data["frames"]]
+        return traceback
+
 
 class TracebackHandler(list):
     """
     Expose traceback list to jinja2.
+
+    Frames are snapshotted when the handler is created: it keeps no
+    reference to the frames of `exc_info`.
     """
 
     @staticmethod
@@ -364,94 +1743,950 @@ class TracebackHandler(list):
             except Exception:
                 return u"encoding error while retreiving message"
 
-    def __init__(self, exc_info):
+    def __init__(self, exc_info, options=None):
+        with stats.timer("traceback"):
+            self._init(exc_info, options)
+
+    def _init(self, exc_info, options):
         etype, evalue, tb = exc_info
+        options = options or TracebackOptions()
+        budget = ReprBudget(options.report_byte_budget)
         if six.PY2:
             self.append(Traceback(evalue.__class__.__name__,
-                                  self.get_msg(evalue), tb))
+                                  self.get_msg(evalue), tb, options, budget))
+            self[-1].snapshot()
         else:
             while evalue:
                 self.append(Traceback(evalue.__class__.__name__,
                                       self.get_msg(evalue),
-                                      evalue.__traceback__))
+                                      evalue.__traceback__,
+                                      options, budget))
+                self[-1].snapshot()
                 evalue = evalue.__context__
         self.reverse()
 
+    def snapshot(self):
+        """
+        Snapshot all tracebacks, so they no longer reference any frame.
+        """
+        for traceback in self:
+            traceback.snapshot()
+        return self
+
+    def to_dict(self):
+        options = self[0].options if self else TracebackOptions()
+        return {
+            "options": options.to_dict(),
+            "tracebacks": [traceback.to_dict() for traceback in self],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Return the tracebacks of `to_dict` output `data`.
+        """
+        options = TracebackOptions.from_dict(data["options"])
+        handler = cls.__new__(cls)
+        handler.extend(
+            Traceback.from_dict(traceback, options)
+            for traceback in data["tracebacks"])
+        return handler
+
+
+# Status of a node with children, by order of precedence.
+status_precedence = ('error', 'fail', 'skip', 'success')
+
+
+def status_from_counts(counts):
+    """
+    Return the status of a node from its number of tests by status.
+    """
+    for status, n in zip(status_precedence, counts):
+        if n:
+            return status
+    return None
+
+
+def read_records(path):
+    """
+    Yield (name, status, url, info) records of an index record log, `info`
+    being a dict of optional test informations (duration, ...).
+    """
+    with codecs.open(str(path), "r", encoding="utf-8") as infile:
+        for line in infile:
+            if line.strip():
+                yield tuple(json.loads(line))
+
+
+def sort_records(paths, tmpdir, chunk_size=100000):
+    """
+    Yield records of the record logs `paths` sorted by name, keeping only the
+    last record of each test, with at most `chunk_size` records in memory.
+    """
+    def sorted_chunks():
+        chunk = []
+        seq = 0
+        for path in paths:
+            for record in read_records(path):
+                chunk.append((record[0].split("."), seq) + record[1:])
+                seq += 1
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    def read_chunk(filename):
+        with codecs.open(filename, "r", encoding="utf-8") as infile:
+            for line in infile:
+                yield tuple(json.loads(line))
+
+    chunk_files = []
+    for chunk in sorted_chunks():
+        chunk.sort()
+        fd, filename = tempfile.mkstemp(dir=str(tmpdir), suffix=".jsonl")
+        with codecs.getwriter("utf-8")(os.fdopen(fd, "wb")) as outfile:
+            for item in chunk:
+                outfile.write(json.dumps(item, separators=(",", ":")))
+                outfile.write("\n")
+        chunk_files.append(filename)
+
+    previous = None
+    for item in heapq.merge(*[read_chunk(x) for x in chunk_files]):
+        if previous is not None and previous[0] != item[0]:
+            yield (".".join(previous[0]),) + previous[2:]
+        previous = item
+    if previous is not None:
+        yield (".".join(previous[0]),) + previous[2:]
+
+
+# Policies of the tests whose page is rendered: all tests, failed tests and
+# tests with console, logs, images or files, or failed tests only.
+render_policies = ("all", "failures-attachments", "failures")
+
+
+def detail_url(name):
+    """
+    Return the url of the generic detail view of the test `name`, shown by
+    the index page from the index data, for tests without page.
+    """
+    return "index.html#" + quote(name, safe="")
+
+
+def leaf_json(title, status, url, info):
+    """
+    Return the json of the index leaf of one test.
+    """
+    node = {"title": title, "url": str(url), "status": status, "childs": []}
+    if info:
+        node.update(info)
+    return json.dumps(node, separators=(",", ":"))
+
+
+def write_index_tree(outfile, records, title=None):
+    """
+    Write the index tree of sorted `records` as compact json, in one pass,
+    and return the number of tests by status (in `status_precedence` order)
+    and their total duration.
+
+    Keys of nodes are written after their children, so the status and the
+    duration of a node are known when written.
+    """
+    rank = dict((status, i) for i, status in enumerate(status_precedence))
+    # Open nodes: [title, counts, has children, duration]
+    stack = [[title, [0] * len(status_precedence), False, 0]]
+    outfile.write('{"title":%s,"url":"None","childs":[' % json.dumps(title))
+
+    def close_node():
+        _, counts, _, duration = stack.pop()
+        outfile.write('],"status":%s,"counts":%s,"duration":%s}' % (
+            json.dumps(status_from_counts(counts)),
+            json.dumps(counts, separators=(",", ":")),
+            json.dumps(round(duration, 3))))
+        if stack:
+            stack[-1][1] = [a + b for a, b in zip(stack[-1][1], counts)]
+            stack[-1][3] += duration
+        return counts, duration
+
+    def open_child():
+        if stack[-1][2]:
+            outfile.write(",")
+        stack[-1][2] = True
+
+    for name, status, url, info in records:
+        toks = name.split(".")
+        common = 0
+        while (common < len(stack) - 1 and common < len(toks) - 1
+               and stack[common + 1][0] == toks[common]):
+            common += 1
+        while len(stack) - 1 > common:
+            close_node()
+        for tok in toks[common:-1]:
+            open_child()
+            outfile.write('{"title":%s,"url":"None","childs":[' % json.dumps(tok))
+            stack.append([tok, [0] * len(status_precedence), False, 0])
+        open_child()
+        outfile.write(leaf_json(toks[-1], status, url, info))
+        if status in rank:
+            stack[-1][1][rank[status]] += 1
+        stack[-1][3] += info.get("duration") or 0
+    while len(stack) > 1:
+        close_node()
+    return close_node()
+
+
+def write_index(outfile, records, output, chunks_dir="index"):
+    """
+    Write the index root of sorted `records` as json, the children of each
+    top level node being written in a javascript chunk of the `chunks_dir`
+    directory of `output`, loaded on demand by the report pages. Return the
+    names of the chunks.
+    """
+    chunks = []
+    outfile.write('{"title":null,"url":"None","childs":[')
+    total = [0] * len(status_precedence)
+    total_duration = 0
+    groups = itertools.groupby(records, key=lambda x: x[0].split(".", 1)[0])
+    for i, (title, group) in enumerate(groups):
+        if i:
+            outfile.write(",")
+        first = next(group)
+        if first[0] == title:
+            # Top level test
+            name, status, url, info = first
+            outfile.write(leaf_json(name, status, url, info))
+            if status in status_precedence:
+                total[status_precedence.index(status)] += 1
+            total_duration += info.get("duration") or 0
+            continue
+        chunk = "%s/%d.js" % (chunks_dir, i)
+        chunks.append(chunk)
+        with output.open(chunk) as binary_file:
+            chunk_file = codecs.getwriter("utf-8")(binary_file)
+            chunk_file.write("index_chunk_loaded(%s, " % json.dumps(chunk))
+            counts, duration = write_index_tree(
+                chunk_file,
+                ((name[len(title) + 1:], status, url, info)
+                 for name, status, url, info in itertools.chain((first,), group)),
+                title,
+            )
+            chunk_file.write(");")
+        outfile.write(
+            '{"title":%s,"url":"None","status":%s,"counts":%s,"duration":%s,'
+            '"chunk":%s,"childs":null}' % (
+                json.dumps(title), json.dumps(status_from_counts(counts)),
+                json.dumps(counts, separators=(",", ":")),
+                json.dumps(round(duration, 3)), json.dumps(chunk)))
+        total = [a + b for a, b in zip(total, counts)]
+        total_duration += duration
+    outfile.write('],"status":%s,"counts":%s,"duration":%s}' % (
+        json.dumps(status_from_counts(total)),
+        json.dumps(total, separators=(",", ":")),
+        json.dumps(round(total_duration, 3))))
+    return chunks
+
+
+class SearchIndexWriter(object):
+    """
+    Write the search index of the tests in `search.js`, from the records
+    written in the index.
+
+    The search index has the names, statuses and durations of the tests by
+    id (position in the index), the RMSE of compared images by id, and ids
+    of the tests by name token, except for tokens common to most tests.
+    `pages` tells which tests have a page, if some have not.
+
+    Sections are written in temporary files of `tmpdir` as tests are added,
+    and the (token, id) pairs sorted by chunks of `chunk_size` pairs: memory
+    holds one chunk, and the ids of one token while writing the tokens, at
+    most an eighth of the tests.
+    """
+
+    token_regex = re.compile(r"[^0-9a-z]+")
+
+    sections = ("status", "durations", "urls", "pages", "rmse")
+
+    def __init__(self, outfile, tmpdir=None, chunk_size=100000):
+        self.outfile = outfile
+        self.tmpdir = tmpdir
+        self.chunk_size = chunk_size
+        self.count = 0
+        self.all_pages = True
+        self.files = dict(
+            (section, tempfile.TemporaryFile(dir=tmpdir))
+            for section in self.sections)
+        self.writers = dict(
+            (section, codecs.getwriter("utf-8")(infile))
+            for section, infile in self.files.items())
+        # Number of items of the sparse sections.
+        self.sparse_counts = {"urls": 0, "rmse": 0}
+        self.postings = []
+        self.posting_files = []
+        self.rank = dict((status, i) for i, status in enumerate(status_precedence))
+        outfile.write('search_index_loaded({"names":[')
+
+    def add(self, name, status, url, info):
+        test_id = self.count
+        self.count += 1
+        if test_id:
+            self.outfile.write(",")
+            self.writers["durations"].write(",")
+        self.outfile.write(json.dumps(name))
+        self.writers["status"].write(
+            str(self.rank.get(status, len(status_precedence))))
+        self.writers["durations"].write(json.dumps(info.get("duration")))
+        if url == detail_url(name):
+            self.all_pages = False
+            self.writers["pages"].write("0")
+        else:
+            self.writers["pages"].write("1")
+            if url != name + ".html":
+                self.add_sparse("urls", test_id, url)
+        if info.get("rmse") is not None:
+            self.add_sparse("rmse", test_id, info["rmse"])
+        for token in set(self.token_regex.split(name.lower())):
+            if token:
+                self.postings.append((token, test_id))
+        if len(self.postings) >= self.chunk_size:
+            self.flush_postings()
+
+    def add_sparse(self, section, test_id, value):
+        if self.sparse_counts[section]:
+            self.writers[section].write(",")
+        self.sparse_counts[section] += 1
+        self.writers[section].write('"%d":%s' % (test_id, json.dumps(value)))
+
+    def flush_postings(self):
+        """
+        Write the sorted (token, id) pairs in a temporary file.
+        """
+        self.postings.sort()
+        outfile = tempfile.TemporaryFile(dir=self.tmpdir)
+        for token, test_id in self.postings:
+            outfile.write(("%s\t%d\n" % (token, test_id)).encode("ascii"))
+        outfile.seek(0)
+        self.posting_files.append(outfile)
+        self.postings = []
+
+    @staticmethod
+    def read_postings(infile):
+        for line in infile:
+            token, test_id = line.decode("ascii").split("\t")
+            yield token, int(test_id)
+
+    def filter(self, records):
+        """
+        Add `records` to the search index while yielding them.
+        """
+        for record in records:
+            self.add(*record)
+            yield record
+
+    def copy_section(self, section):
+        infile = self.files[section]
+        self.writers[section].flush()
+        infile.seek(0)
+        reader = codecs.getreader("utf-8")(infile)
+        for block in iter(lambda: reader.read(64 * 1024), u""):
+            self.outfile.write(block)
+
+    def write_tokens(self, max_ids):
+        """
+        Write the ids of the tests by token, and return the tokens of more
+        than `max_ids` tests, not written.
+        """
+        self.postings.sort()
+        postings = heapq.merge(
+            iter(self.postings),
+            *[self.read_postings(infile) for infile in self.posting_files])
+        common = []
+        first = True
+        for token, group in itertools.groupby(postings, key=lambda x: x[0]):
+            ids = [x[1] for x in itertools.islice(group, max_ids + 1)]
+            if len(ids) > max_ids:
+                common.append(token)
+                continue
+            if not first:
+                self.outfile.write(",")
+            first = False
+            self.outfile.write(json.dumps(token))
+            self.outfile.write(":[")
+            self.outfile.write(",".join(str(x) for x in ids))
+            self.outfile.write("]")
+        return common
+
+    def close(self):
+        self.outfile.write('],"status":"')
+        self.copy_section("status")
+        self.outfile.write('","durations":[')
+        self.copy_section("durations")
+        self.outfile.write('],"urls":{')
+        self.copy_section("urls")
+        self.outfile.write('},"pages":"')
+        if not self.all_pages:
+            self.copy_section("pages")
+        self.outfile.write('","rmse":{')
+        self.copy_section("rmse")
+        self.outfile.write('},"tokens":{')
+        # Tokens found in most names are not worth indexing.
+        common = self.write_tokens(max(1000, self.count // 8))
+        self.outfile.write('},"common":%s});' % json.dumps(common))
+        for infile in list(self.files.values()) + self.posting_files:
+            infile.close()
+
+
+# Status codes of index leaves, by status.
+status_codes = dict((status, i) for i, status in enumerate(status_precedence))
+
+
+class TestIndexLeaf(object):
+    """
+    Index entry of one test.
+
+    The status is stored as its position in `status_precedence`, the url
+    only if not the default page of the test, and `info` as the duration
+    and a tuple of the other items.
+    """
+
+    __slots__ = ("_status", "_url", "_duration", "_info")
+
+    is_leaf = True
+
+    def __init__(self, name, status, url, info=None):
+        self._status = status_codes.get(status, status)
+        self._url = None if url == name + ".html" else url
+        info = dict(info or ())
+        self._duration = info.pop("duration", None)
+        self._info = tuple(sorted(info.items())) if info else None
+
+    @property
+    def status(self):
+        if isinstance(self._status, int):
+            return status_precedence[self._status]
+        return self._status
+
+    def get_url(self, name):
+        """
+        Return the url of the test, `name` being its full name.
+        """
+        return name + ".html" if self._url is None else str(self._url)
+
+    @property
+    def info(self):
+        info = dict(self._info or ())
+        if self._duration is not None:
+            info["duration"] = self._duration
+        return info
+
+    def get_status(self):
+        return self.status
+
+    def get_counts(self):
+        counts = dict.fromkeys(status_precedence, 0)
+        counts[self.status] = 1
+        return counts
+
 
 class TestIndexNode(dict):
+    """
+    Node of the test index, the children being `TestIndexNode` and
+    `TestIndexLeaf` by interned name.
+
+    Nodes count tests by status, updated when a test is added, and keep the
+    names of their children sorted.
+    """
 
-    def __init__(self, name=None, status=None, url=None):
+    __slots__ = ("_name", "_counts", "_keys")
+
+    is_leaf = False
+
+    def __init__(self, name=None):
         self._name = name
-        self._status = status
-        self._url = url
+        # Number of tests by status, in `status_precedence` order.
+        self._counts = [0] * len(status_precedence)
+        self._keys = []
 
     def get_status(self):
-        if self._status is None:
-            status_count = {
-                'success': 0,
-                'fail': 0,
-                'error': 0,
-                'skip': 0,
-            }
-            for child in self.values():
-                status_count[child.get_status()] += 1
-            for name in ('error', 'fail', 'skip', 'success'):
-                if status_count[name]:
-                    self._status = name
-                    break
-        return self._status
+        return status_from_counts(self._counts)
 
-    def as_json(self):
-        return {
+    def get_counts(self):
+        """
+        Return the number of tests by status below this node.
+        """
+        return dict(zip(status_precedence, self._counts))
+
+    def count(self, status, n=1):
+        code = status_codes.get(status)
+        if code is not None:
+            self._counts[code] += n
+
+    def set_child(self, name, node):
+        if name not in self:
+            if isinstance(name, str):
+                name = intern(name)
+            bisect.insort(self._keys, name)
+        self[name] = node
+
+    def sorted_items(self):
+        return [(name, self[name]) for name in self._keys]
+
+    def as_json(self, prefix=()):
+        data = {
             'title': self._name,
-            'url': str(self._url),
+            'url': 'None',
             'status': self.get_status(),
-            'childs': [x[1].as_json() for x in sorted(self.items())]
+            'childs': [],
         }
+        for name, child in self.sorted_items():
+            path = prefix + (name,)
+            if child.is_leaf:
+                leaf = {
+                    'title': name,
+                    'url': child.get_url(".".join(path)),
+                    'status': child.status,
+                    'childs': [],
+                }
+                leaf.update(child.info)
+                data['childs'].append(leaf)
+            else:
+                data['childs'].append(child.as_json(path))
+        return data
+
+    def iter_records(self, prefix=()):
+        """
+        Yield (name, status, url, info) for each test below this node.
+        """
+        for name, child in self.sorted_items():
+            path = prefix + (name,)
+            if child.is_leaf:
+                full_name = ".".join(path)
+                yield (full_name, child.status, child.get_url(full_name),
+                       child.info)
+            else:
+                for record in child.iter_records(path):
+                    yield record
 
 
 class TestIndexRoot(TestIndexNode):
+    """
+    Index of all tests, responsible of the report pages.
+
+    With `shared_assets`, css and javascript are written once in `report.css`
+    and `report.js` instead of being inlined in every page.
+
+    With `render_workers`, pages are rendered in background by a pool of
+    `render_pool` ("thread" or "process") workers, tests results being
+    snapshotted when appended.
+
+    With `streaming_index`, tests are not kept in memory but written in a
+    record log as they finish, the index being built from the log by
+    `make_report`.
+
+    `shard` is the name of the record log of a partial index, merged in the
+    final report by the main index (`shard` is None).
+
+    Images of the tests are compared in background by `image_comparator`,
+    running at most `compare_workers` comparisons at once with
+    `compare_backend` and `compare_tolerance`, with thumbnails of
+    `thumbnail_size` and `thumbnail_format` (see `ImageComparator`); tests
+    are added to the index once their images are processed. Attachments are
+    written once in the content addressed `attachments` store.
+
+    Time and bytes spent by the report are written in `report-stats.json`,
+    with a cProfile dump of the report generation in `profile` if given.
+
+    With `bundle`, the report is written in the zip file `<html_path>.zip`
+    as tests run, `html_path` only keeping attachments until they are added
+    to the bundle by `make_report`; use `html-test serve` to browse it.
+
+    With `render_on_demand`, test pages are not rendered: only their data is
+    written, as json in `tests/`, pages being rendered when requested by
+    `html-test serve`.
+
+    `render_policy` (see `render_policies`) selects the tests whose page is
+    rendered, other tests linking to a generic detail view of the index
+    page.
+    """
 
-    def __init__(self, html_path, global_context=None):
+    # Maximum number of pending pages per worker before waiting.
+    max_pending_per_worker = 64
+    # Number of last tests of a streaming index whose status is kept, to
+    # count a rerun test once.
+    max_recent_statuses = 1024
+
+    def __init__(
+        self,
+        html_path,
+        global_context=None,
+        shared_assets=False,
+        render_workers=0,
+        render_pool="thread",
+        streaming_index=False,
+        shard=None,
+        compare_workers=None,
+        compare_backend="auto",
+        compare_tolerance=0,
+        thumbnail_size=320,
+        thumbnail_format="png",
+        profile=None,
+        bundle=False,
+        render_on_demand=False,
+        render_policy="all",
+    ):
         super(TestIndexRoot, self).__init__()
         html_path.mkdir(exist_ok=True, parents=True)
         self._html_path = html_path
+        self._shard = shard
+        self._profile = profile
+        self._render_on_demand = render_on_demand
+        if render_policy not in render_policies:
+            raise ValueError("Unknown render policy: %s" % render_policy)
+        self._render_policy = render_policy
+        stats.clear()
+        if profile:
+            stats.enable_profile()
+        if shard is None:
+            self.clear_records()
+        if not bundle:
+            self.output = DirectoryOutput(html_path)
+        elif shard is None:
+            self.output = ZipOutput(bundle_path(html_path), html_path)
+        else:
+            self.records_path.mkdir(exist_ok=True)
+            self.output = ZipOutput(self.shard_bundle_path, html_path)
+        if shard is None:
+            self.output.remove_tree("tests")
+        self._record_log = None
+        # Status of the last tests of the record log, by name.
+        self._statuses = collections.OrderedDict()
+        if streaming_index:
+            self.records_path.mkdir(exist_ok=True)
+            self._record_log = codecs.open(
+                str(self.record_log_path), "w", encoding="utf-8")
         self._global_context = global_context or {}
         self._global_context.update(
             {
                 "hostname": socket.gethostname(),
                 "date": datetime.datetime.now(),
+                "shared_assets": shared_assets,
             }
         )
+        self.image_comparator = ImageComparator(
+            compare_workers, compare_backend, compare_tolerance,
+            thumbnail_size, thumbnail_format)
+        self.attachments = AttachmentStore(html_path)
+        self._comparing = []
+        self._executor = None
+        self._pending = collections.deque()
+        if render_workers:
+            from concurrent import futures
+
+            if render_pool == "process":
+                executor_class = futures.ProcessPoolExecutor
+            else:
+                executor_class = futures.ThreadPoolExecutor
+            self._executor = executor_class(max_workers=render_workers)
+            self._max_pending = render_workers * self.max_pending_per_worker
+        # Statistics of pages rendered in worker processes are merged here.
+        self._render_process = bool(render_workers) and render_pool == "process"
+
+    def _wait_pending(self, max_pending=0):
+        """
+        Wait for background rendering until at most `max_pending` pages are
+        pending.
+        """
+        while self._pending and (
+            self._pending[0][1].done() or len(self._pending) > max_pending
+        ):
+            filename, future = self._pending.popleft()
+            try:
+                page = future.result()
+                if self._render_process:
+                    page, page_stats = page
+                    stats.merge(page_stats)
+                self.output.write(filename, page)
+            except Exception as e:
+                stdout.write(
+                    "Fail to render test report: %s: %s\n"
+                    % (e.__class__.__name__, e)
+                )
+
+    def has_page(self, test_report):
+        """
+        Whether the page of `test_report` is rendered, by the render policy.
+        """
+        if self._render_policy == "all" or test_report.status in ("error", "fail"):
+            return True
+        return (
+            self._render_policy == "failures-attachments"
+            and test_report.has_attachments)
+
+    def render(self, test_report):
+        """
+        Render the page of `test_report` and return its url.
+        """
+        if not self.has_page(test_report):
+            return detail_url(test_report.name)
+        if self._render_on_demand:
+            self.output.write(test_report.data_filename, test_report.dumps())
+            return test_report.filename
+        if self._executor is None:
+            return test_report.render(self.output, self._global_context)
+        filename = test_report.filename
+        render_page = test_report.snapshot().render_page
+        if self._render_process:
+            render_page = functools.partial(render_page_job, render_page)
+        self._pending.append((
+            filename, self._executor.submit(render_page, self._global_context)))
+        self._wait_pending(self._max_pending)
+        return filename
 
     def append(self, test_report):
-        filename = test_report.render(self._html_path, self._global_context)
-        toks = test_report.name.split(".")
+        with stats.timer("append"):
+            self._append_or_wait(test_report)
+
+    def _append_or_wait(self, test_report):
+        if test_report.pending():
+            # Wait for image comparisons, without keeping the test frames.
+            self._comparing.append(test_report.snapshot())
+        else:
+            self._append(test_report)
+        if self._comparing:
+            self._wait_comparing(block=False)
+
+    def _wait_comparing(self, block=True):
+        """
+        Add the tests whose image comparisons are done, waiting for all of
+        them if `block`.
+        """
+        comparing = self._comparing
+        self._comparing = []
+        for test_report in comparing:
+            if block or all(future.done() for future in test_report.pending()):
+                self._append(test_report.wait())
+            else:
+                self._comparing.append(test_report)
+
+    def _append(self, test_report):
+        filename = self.render(test_report)
+        if self._record_log is not None:
+            self._record_log.write(
+                json.dumps(
+                    (test_report.name, test_report.status, filename,
+                     test_report.index_info),
+                    separators=(",", ":"),
+                )
+            )
+            self._record_log.write("\n")
+            self.add(test_report.name, test_report.status, filename,
+                     keep_leaf=False)
+        else:
+            self.add(test_report.name, test_report.status, filename,
+                     test_report.index_info)
+
+    def add(self, name, status, url, info=None, keep_leaf=True):
+        """
+        Add the test `name` to the index, updating status counts of its
+        parents.
+
+        Without `keep_leaf`, only the parents are kept: a test added again is
+        counted once if it is one of the `max_recent_statuses` last tests
+        added, as reruns are, the counts being approximate otherwise. The
+        report counts are exact, the index being built from the sorted
+        records.
+        """
+        full_name = name
+        toks = name.split(".")
         name = toks[-1]
-        node = self
+        nodes = [self]
         for tok in toks[:-1]:
+            node = nodes[-1]
             if tok not in node:
-                node[tok] = TestIndexNode(tok)
-            node = node[tok]
-        node[name] = TestIndexNode(name, test_report.status, filename)
+                node.set_child(tok, TestIndexNode(tok))
+            nodes.append(node[tok])
+        node = nodes[-1]
+        if keep_leaf:
+            old = node.get(name)
+            if old is not None and old.is_leaf:
+                for parent in nodes:
+                    parent.count(old.status, -1)
+            node.set_child(name, TestIndexLeaf(full_name, status, url, info))
+        else:
+            old = self._statuses.pop(full_name, None)
+            if old is not None:
+                for parent in nodes:
+                    parent.count(old, -1)
+            self._statuses[full_name] = status
+            if len(self._statuses) > self.max_recent_statuses:
+                self._statuses.popitem(last=False)
+        for parent in nodes:
+            parent.count(status)
+
+    def wait(self):
+        """
+        Wait for all test pages to be rendered.
+        """
+        self._wait_comparing()
+        self.image_comparator.shutdown()
+        if self._executor is not None:
+            self._wait_pending()
+            self._executor.shutdown()
+            self._executor = None
+
+    @property
+    def records_path(self):
+        return self._html_path / "records"
+
+    @property
+    def record_log_path(self):
+        return self.records_path / ("%s.jsonl" % (self._shard or "index"))
+
+    @property
+    def stats_path(self):
+        return self.records_path / ("%s.stats.json" % self._shard)
+
+    @property
+    def shard_bundle_path(self):
+        return self.records_path / ("%s.zip" % self._shard)
+
+    def clear_records(self):
+        """
+        Remove index record logs, left by a previous run or merged.
+        """
+        if self.records_path.exists():
+            shutil.rmtree(str(self.records_path))
+
+    def write_shard(self):
+        """
+        Wait for test pages and save the record log of this shard, to be
+        merged by the main index, instead of creating the report.
+        """
+        self.wait()
+        self.output.close()
+        self.records_path.mkdir(exist_ok=True)
+        stats.write(self.stats_path)
+        if self._record_log is not None:
+            self._record_log.close()
+            self._record_log = None
+            return
+        tmp = self.records_path / ("%s.tmp" % self._shard)
+        with codecs.open(str(tmp), "w", encoding="utf-8") as outfile:
+            for record in self.iter_records():
+                outfile.write(json.dumps(record, separators=(",", ":")))
+                outfile.write("\n")
+        tmp.rename(self.record_log_path)
+
+    def merge_shards(self):
+        """
+        Add tests of the shards record logs to this index.
+        """
+        if not self.records_path.exists():
+            return
+        for path in self.records_path.glob("*.stats.json"):
+            with open(str(path)) as infile:
+                stats.merge(json.load(infile))
+        if isinstance(self.output, ZipOutput):
+            for path in sorted(self.records_path.glob("*.zip")):
+                self.output.add_bundle(path)
+        if self._record_log is not None:
+            # Streaming index reads all the logs in `make_report`.
+            return
+        for path in sorted(self.records_path.glob("*.jsonl")):
+            for record in read_records(path):
+                self.add(*record)
+
+    def iter_sorted_records(self):
+        """
+        Yield records of all tests sorted by name.
+        """
+        if self._record_log is None:
+            for record in self.iter_records():
+                yield record
+            return
+        self._record_log.close()
+        self._record_log = None
+        tmpdir = tempfile.mkdtemp(dir=str(self.records_path))
+        try:
+            paths = sorted(self.records_path.glob("*.jsonl"))
+            for record in sort_records(paths, tmpdir):
+                yield record
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def make_report(self, write_line=None):
+        """
+        Create html report for the tests results, its summary being written
+        by `write_line`, one line per call, or on stdout.
+        """
+        if write_line is None:
+            write_line = lambda line: stdout.write(line + "\n")
+        with stats.timer("make_report"):
+            self._make_report()
+        self.output.write(
+            "report-stats.json",
+            json.dumps(stats.as_dict(), indent=2, sort_keys=True).encode("utf-8"),
+        )
+        if self._profile:
+            stats.dump_profile(self._profile)
+        self.close_output(write_line)
+        write_line(stats.summary())
 
-    def make_report(self):
+    def close_output(self, write_line=None):
         """
-        Create html report for the tests results.
+        Close the report output, adding attachments to the bundle, whose path
+        is written by `write_line`, or on stdout.
         """
+        if not isinstance(self.output, ZipOutput):
+            return
+        for name in ("img", "data"):
+            self.output.add_work_files(name)
+        self.output.close()
+        for name in ("img", "data"):
+            path = self._html_path / name
+            if path.exists():
+                shutil.rmtree(str(path))
+        try:
+            self._html_path.rmdir()
+        except OSError:
+            pass
+        line = "Report bundle: %s" % self.output.path
+        if write_line is None:
+            stdout.write(line + "\n")
+        else:
+            write_line(line)
+
+    def _make_report(self):
+        self.wait()
         # Create index data
-        template = Template("var index = {{data|safe}};")
-        index_js = self._html_path / "index.js"
-        with index_js.open("w") as outfile:
-            outfile.write(
-                template.render({"data": json.dumps(self.as_json(), indent=4)})
-            )
+        self.output.remove_tree("index")
+        utf8_writer = codecs.getwriter("utf-8")
+        with stats.timer("index"), \
+                self.output.open("index.js") as index_file, \
+                self.output.open("search.js") as search_file:
+            outfile = utf8_writer(index_file)
+            search = SearchIndexWriter(
+                utf8_writer(search_file), str(self._html_path))
+            outfile.write("var index = ")
+            chunks = write_index(
+                outfile, search.filter(self.iter_sorted_records()), self.output)
+            outfile.write(";")
+            search.close()
+        for name in ["index.js", "search.js"] + chunks:
+            stats.add("index", size=self.output.size(name), calls=0)
+        self.clear_records()
+        # Create shared assets
+        if self._global_context["shared_assets"]:
+            for name in ("report.css", "report.js"):
+                template = get_template(name)
+                self.output.write(
+                    name,
+                    template.render({"pygments_css": pygments_css}).encode("utf-8"),
+                )
+        if self._render_on_demand:
+            # Context of the test pages rendered on demand.
+            self.output.write("context.json", json.dumps(
+                self._global_context, default=six.text_type).encode("utf-8"))
         # Create index page
-        template = Template(
-            pkg_resources.resource_string(
-                "html_test_report", os.path.join("templates", "test-case.html")
-            ).decode("utf-8")
-        )
-        index_html = self._html_path / "index.html"
-        with codecs.open(str(index_html), "w", encoding="utf-8") as outfile:
-            outfile.write(template.render(self._global_context))
+        template = get_template("test-case.html")
+        self.output.write(
+            "index.html", template.render(self._global_context).encode("utf-8"))
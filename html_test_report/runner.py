@@ -1,17 +1,18 @@
 # -*- coding: utf-8 -*-
-from six.moves import cStringIO as StringIO
 import datetime
-import json
 import logging
 import sys
+import time
 import unittest
 
+from .report import ConsoleCapture
 from .report import FileResult
 from .report import ImageResult
+from .report import LogCollector
 from .report import TestCaseReport
-from .report import TestFormatter
 from .report import TestIndexRoot
 from .report import TracebackHandler
+from .report import TracebackOptions
 from .report import status_dict
 
 
@@ -29,10 +30,24 @@ class ResultMixIn(object):
         self._buffer_console = None
         self._buffer_log = None
         self._options = {}
+        self._console_max_size = 1024 * 1024
+        self._max_log_records = 10000
+        self._start_time = None
 
-    def setup(self, html_path, links=None):
+    def setup(self, html_path, links=None, traceback_options=None,
+              console_max_size=1024 * 1024, max_log_records=10000, **options):
+        """
+        Prepare the report in `html_path`, `options` are forwarded to
+        `TestIndexRoot`. Console output beyond `console_max_size` bytes is
+        spilled to disk, only its head and tail being shown in test pages.
+        At most `max_log_records` log records are kept by test.
+        """
         self._html_path = html_path
-        self._index = TestIndexRoot(html_path, {"links": links})
+        self._options = options
+        self._console_max_size = console_max_size
+        self._max_log_records = max_log_records
+        self._traceback_options = traceback_options or TracebackOptions()
+        self._index = TestIndexRoot(html_path, {"links": links}, **options)
 
     def add_result_method(self, status, test, exc_info=None, reason=None):
         """
@@ -42,16 +57,26 @@ class ResultMixIn(object):
             # We are using nosetest. `test` is a nose wrapper.
             test = test.test
 
-        tb = TracebackHandler(exc_info) if exc_info is not None else None
+        if exc_info is not None:
+            tb = TracebackHandler(exc_info, self._traceback_options)
+        else:
+            tb = None
         try:
-            console = self._buffer_console.getvalue()
+            console, console_file = self._buffer_console.get_console(
+                self._index.attachments)
         except AttributeError:
-            console = None
+            console = console_file = None
         try:
-            log = self._buffer_log.getvalue()
-            log = [json.loads(x) for x in log.splitlines()]
+            log = self._buffer_log.records
+            logs_dropped = self._buffer_log.dropped
         except AttributeError:
             log = None
+            logs_dropped = 0
+
+        if self._start_time is not None:
+            duration = time.time() - self._start_time
+        else:
+            duration = None
 
         test_class = test.__class__
         name = "%s.%s.%s" % (
@@ -65,8 +90,11 @@ class ResultMixIn(object):
                     html_path=self._html_path,
                     result=img.get("result"),
                     expected=img.get("expected"),
+                    comparator=self._index.image_comparator,
+                    store=self._index.attachments,
+                    img_type=img.get("type"),
                 )
-                images.append(img.to_dict())
+                images.append(img)
             except AttributeError:
                 pass
         files = []
@@ -77,6 +105,7 @@ class ResultMixIn(object):
                     title=f.get("title"),
                     content=f.get("content"),
                     content_type=f.get("content_type"),
+                    store=self._index.attachments,
                 ).to_dict()
             )
 
@@ -87,7 +116,10 @@ class ResultMixIn(object):
                 doc_class=test_class.__doc__,
                 doc_test=getattr(test, "_testMethodDoc", ""),
                 console=console,
+                console_file=console_file,
                 logs=log,
+                logs_dropped=logs_dropped,
+                duration=duration,
                 tracebacks=tb,
                 reason=reason,
                 images=images,
@@ -106,10 +138,11 @@ class ResultMixIn(object):
         stdout.write(
             "Run test: %s.%s... " %
             (test.__class__.__name__, test._testMethodName))
+        self._start_time = time.time()
         # Capture stdout and stderr.
         self._old_stderr = sys.stderr
         self._old_stdout = sys.stdout
-        self._buffer_console = StringIO()
+        self._buffer_console = ConsoleCapture(self._console_max_size)
         sys.stdout = sys.stderr = self._buffer_console
 
         # Capture logs
@@ -117,11 +150,8 @@ class ResultMixIn(object):
         for handler in logging.root.handlers[:]:
             logging.root.removeHandler(handler)
             self._old_handlers.append(handler)
-        self._buffer_log = StringIO()
-        handler = logging.StreamHandler(stream=self._buffer_log)
-        handler.setFormatter(TestFormatter())
-        handler.setLevel(logging.DEBUG)
-        logging.root.addHandler(handler)
+        self._buffer_log = LogCollector(self._max_log_records)
+        logging.root.addHandler(self._buffer_log)
 
     def stopTest(self, test):
         # Restore stdout and stderr.
@@ -177,6 +207,8 @@ class HtmlTestRunner(object):
 
     Can be use:
     * standalone, just replace `python -m unittest` with `html-test`
+
+    Extra keyword arguments are report options, see `TestIndexRoot`.
     """
 
     def __init__(
@@ -189,6 +221,7 @@ class HtmlTestRunner(object):
         resultclass=None,
         html_path=None,
         links=None,
+        **options
     ):
         self.stream = stream
         self.descriptions = descriptions
@@ -199,10 +232,11 @@ class HtmlTestRunner(object):
         self.start_time = datetime.datetime.now()
         self.html_path = html_path
         self.links = links
+        self.options = options
 
     def run(self, tests_collection):
         result = HtmlTestResult(self.verbosity)
-        result.setup(self.html_path, self.links)
+        result.setup(self.html_path, self.links, **self.options)
         tests_collection(result)
         self.stop_time = datetime.datetime.now()
         result.make_report()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Local viewer of a report, from its directory or its zip bundle.
+
+Pages of reports made with `render_on_demand` are rendered when requested,
+from the test data in `tests/`.
+"""
+import argparse
+import json
+import mimetypes
+import posixpath
+import threading
+import zipfile
+
+import six
+from six.moves import BaseHTTPServer
+from six.moves.urllib.parse import unquote
+from six.moves.urllib.parse import urlsplit
+
+if six.PY2:
+    import pathlib2 as pathlib
+else:
+    import pathlib
+
+
+class DirectoryReader(object):
+    """
+    Files of a report directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, name):
+        """
+        Return the content of the file `name`, or None if missing.
+        """
+        path = self.path / name
+        if not path.is_file():
+            return None
+        with path.open("rb") as infile:
+            return infile.read()
+
+
+class ZipReader(object):
+    """
+    Files of a report zip bundle, decompressed on request.
+    """
+
+    def __init__(self, path):
+        self._zip = zipfile.ZipFile(str(path))
+        self._lock = threading.Lock()
+
+    def read(self, name):
+        with self._lock:
+            try:
+                return self._zip.read(name)
+            except KeyError:
+                return None
+
+
+class ReportPages(object):
+    """
+    Files of a report, test pages missing from the report being rendered from
+    their data. Rendered pages are kept in a cache of `cache_size` bytes.
+    """
+
+    def __init__(self, report, cache_size=64 * 1024 * 1024):
+        from .report import LRUCache
+
+        self.report = report
+        self._cache = LRUCache(max_size=cache_size, sizeof=len)
+        context = report.read("context.json")
+        self._global_context = json.loads(context.decode("utf-8")) if context else {}
+
+    def read(self, name):
+        data = None
+        if name.endswith(".html") and name != "index.html":
+            data = self._cache.get(name, lambda: self.render(name))
+        if data is None:
+            data = self.report.read(name)
+        return data
+
+    def render(self, name):
+        """
+        Return the test page `name` rendered from its data, or None.
+        """
+        from .report import TestCaseReport
+
+        data = self.report.read("tests/%s.json" % name[:-len(".html")])
+        if data is None:
+            return None
+        return TestCaseReport.loads(data).render_page(dict(self._global_context))
+
+
+def open_report(path):
+    """
+    Return the reader of the report `path`, a directory or a zip bundle.
+    """
+    path = pathlib.Path(path)
+    if path.is_dir():
+        return DirectoryReader(path)
+    if not path.exists() and pathlib.Path(str(path) + ".zip").exists():
+        path = pathlib.Path(str(path) + ".zip")
+    return ZipReader(path)
+
+
+class ReportRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Reader of the report, set by `make_server`.
+    report = None
+
+    def do_GET(self):
+        name = posixpath.normpath(unquote(urlsplit(self.path).path)).lstrip("/")
+        if name in ("", "."):
+            name = "index.html"
+        data = None
+        if not name.startswith(".."):
+            data = self.report.read(name)
+        if data is None:
+            self.send_error(404, "File not found")
+            return
+        content_type = mimetypes.guess_type(name)[0]
+        self.send_response(200)
+        self.send_header("Content-Type", content_type or "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(path, host="localhost", port=8000):
+    """
+    Return an http server of the report `path`.
+    """
+    handler = type(
+        "ReportRequestHandler", (ReportRequestHandler,),
+        {"report": ReportPages(open_report(path))})
+    return BaseHTTPServer.HTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="html-test serve",
+        description="Serve a html test report, from its directory or its zip "
+        "bundle",
+    )
+    parser.add_argument(
+        "path", nargs="?", default="html", help="Report directory or bundle")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default=8000, type=int)
+    args = parser.parse_args(argv)
+    server = make_server(args.path, args.host, args.port)
+    print("Serving %s on http://%s:%d/" % (args.path, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
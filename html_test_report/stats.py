@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Time and size spent by the report generation itself.
+"""
+import contextlib
+import json
+import threading
+import time
+
+# Best available clock for durations.
+clock = getattr(time, "perf_counter", time.time)
+
+
+class ReportStats(object):
+    """
+    Time, calls and bytes spent by the report, by phase.
+
+    Phases may be nested, the total time only counting outermost phases.
+    With `enable_profile`, outermost phases of the main thread are also
+    profiled with cProfile.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.total = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profile = None
+
+    def add(self, phase, seconds=0.0, size=0, calls=1):
+        """
+        Count `calls` of `phase`, taking `seconds` and producing `size`
+        bytes.
+        """
+        with self._lock:
+            stats = self.phases.get(phase)
+            if stats is None:
+                stats = self.phases[phase] = [0, 0.0, 0]
+            stats[0] += calls
+            stats[1] += seconds
+            stats[2] += size
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """
+        Context manager timing one call of `phase`.
+        """
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        profile = None
+        if depth == 0 and self._profile is not None \
+                and threading.current_thread().name == "MainThread":
+            profile = self._profile
+            profile.enable()
+        start = clock()
+        try:
+            yield
+        finally:
+            seconds = clock() - start
+            if profile is not None:
+                profile.disable()
+            self._local.depth = depth
+            self.add(phase, seconds)
+            if depth == 0:
+                with self._lock:
+                    self.total += seconds
+
+    def enable_profile(self):
+        import cProfile
+
+        self._profile = cProfile.Profile()
+
+    def dump_profile(self, path):
+        """
+        Write the cProfile statistics in `path`, if profiling is enabled.
+        """
+        if self._profile is not None:
+            self._profile.dump_stats(str(path))
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "total": round(self.total, 6),
+                "phases": dict(
+                    (phase, {
+                        "calls": calls,
+                        "seconds": round(seconds, 6),
+                        "bytes": size,
+                    })
+                    for phase, (calls, seconds, size) in self.phases.items()
+                ),
+            }
+
+    def merge(self, data):
+        """
+        Add statistics of `as_dict` output `data`, from another process.
+        """
+        for phase, stats in data["phases"].items():
+            self.add(phase, stats["seconds"], stats["bytes"], stats["calls"])
+        with self._lock:
+            self.total += data["total"]
+
+    def write(self, path):
+        with open(str(path), "w") as outfile:
+            json.dump(self.as_dict(), outfile, indent=2, sort_keys=True)
+
+    def summary(self):
+        """
+        Return a one line summary of the statistics.
+        """
+        with self._lock:
+            phases = sorted(
+                self.phases.items(), key=lambda x: x[1][1], reverse=True)
+            size = sum(x[1][2] for x in phases)
+            return "html report: %.2fs (%s), %.1f MB written" % (
+                self.total,
+                ", ".join(
+                    "%s %.2fs" % (phase, seconds)
+                    for phase, (_, seconds, _) in phases[:5]
+                ),
+                size / (1024.0 * 1024.0),
+            )
+
+    def clear(self):
+        with self._lock:
+            self.phases.clear()
+            self.total = 0.0
+
+
+# Statistics of the report of this process.
+stats = ReportStats()
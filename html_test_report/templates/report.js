@@ -0,0 +1,580 @@
+function var_toggle(link, id) {
+    var e = document.getElementById(id);
+    if (e) {
+        e.style.display = e.style.display == 'none' ? 'block' : 'none';
+    }
+    var s = link.getElementsByTagName('span')[0];
+    var uarr = String.fromCharCode(0x25b6);
+    var darr = String.fromCharCode(0x25bc);
+    s.textContent = s.textContent == uarr ? darr : uarr;
+    return false;
+}
+
+function context_toggle(e) {
+    var lines = e.getElementsByClassName('code-line-extended');
+    var i, line;
+    for (i = 0; i < lines.length; i++) {
+        line = lines[i];
+        line.style.display = line.style.display == 'none' ? 'table-row' : 'none';
+    }
+    var highlighted = e.getElementsByClassName('code-line-highlight');
+    if (highlighted.lenght == 0) {
+        return;
+    }
+    line = highlighted[0];
+    var yoffset = line.offsetTop + (line.clientHeight / 2) - e.clientHeight / 2;
+    e.scrollTo(0, yoffset);
+};
+
+var INDEX_ROW_HEIGHT = 20;
+var INDEX_OVERSCAN = 20;
+var index_rows = [];
+var index_filter_errors = false;
+var index_chunks = {};
+var index_search_results = null;
+var search_index = null;
+var search_callbacks = null;
+// Column the search results are sorted by.
+var search_sort = '';
+var search_status_names = ['error', 'fail', 'skip', 'success', 'unknown'];
+var status_titles = {error: 'Error', fail: 'Fail', skip: 'Skip', success: 'Success'};
+var index_current = null;
+var TIMING_SLOWEST = 20;
+var timing_loaded = false;
+
+function index_escape(text) {
+    return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+};
+
+function index_is_error(node) {
+    return node.status == 'error' || node.status == 'fail';
+};
+
+function index_has_childs(node) {
+    return node.chunk ? true : node.childs.length > 0;
+};
+
+function index_load_chunk(node, callback) {
+    // Children of top level nodes are loaded on first expand.
+    if (node.childs !== null) {
+        callback();
+        return;
+    }
+    var pending = index_chunks[node.chunk];
+    if (pending) {
+        pending.callbacks.push(callback);
+        return;
+    }
+    index_chunks[node.chunk] = {node: node, callbacks: [callback]};
+    var script = document.createElement('script');
+    script.src = node.chunk;
+    document.head.appendChild(script);
+};
+
+function index_chunk_loaded(chunk, data) {
+    var pending = index_chunks[chunk];
+    var i;
+    delete index_chunks[chunk];
+    pending.node.childs = data.childs;
+    for (i = 0; i < pending.callbacks.length; i++) {
+        pending.callbacks[i]();
+    }
+};
+
+function index_build_rows() {
+    // Flatten the expanded part of the tree in the list of visible rows,
+    // or list the search results.
+    var rows = [];
+    var i;
+    function visit(node, depth) {
+        var i, child;
+        for (i = 0; i < node.childs.length; i++) {
+            child = node.childs[i];
+            if (index_filter_errors && !index_is_error(child)) {
+                continue;
+            }
+            rows.push({node: child, depth: depth});
+            if (child.expanded && child.childs) {
+                visit(child, depth + 1);
+            }
+        }
+    }
+    if (index_search_results === null) {
+        visit(index, 0);
+    }
+    index_rows = rows;
+    var view = document.getElementById('index-tree-view');
+    view.firstChild.style.height = (index_row_count() * INDEX_ROW_HEIGHT) + 'px';
+    index_render();
+};
+
+function index_row_count() {
+    return index_search_results === null ? index_rows.length : index_search_results.length;
+};
+
+function index_get_row(i) {
+    if (index_search_results === null) {
+        return index_rows[i];
+    }
+    return {node: search_node(index_search_results[i]), depth: 0, search: true};
+};
+
+function index_format_duration(duration) {
+    if (duration < 60) {
+        return duration.toFixed(3) + 's';
+    }
+    return Math.floor(duration / 60) + 'm' + (duration % 60).toFixed(0) + 's';
+};
+
+function index_render() {
+    // Only rows in the visible part of the tree view are in the DOM.
+    var view = document.getElementById('index-tree-view');
+    var first = Math.max(0, Math.floor(view.scrollTop / INDEX_ROW_HEIGHT) - INDEX_OVERSCAN);
+    var last = Math.min(
+        index_row_count(),
+        Math.ceil((view.scrollTop + view.clientHeight) / INDEX_ROW_HEIGHT) + INDEX_OVERSCAN);
+    var html = '';
+    var i, row, node, url;
+    for (i = first; i < last; i++) {
+        row = index_get_row(i);
+        node = row.node;
+        html += '<div class="index-row" data-row="' + i + '" style="top: '
+            + (i * INDEX_ROW_HEIGHT) + 'px; padding-left: ' + (row.depth * 15) + 'px;">';
+        if (index_has_childs(node)) {
+            html += '<span class="caret' + (node.expanded ? ' caret-down' : '') + '"></span>';
+        }
+        if (node.status == 'success') {
+            html += '<span class="status-success"></span>';
+        } else if (index_is_error(node)) {
+            html += '<span class="status-fail-error"></span>';
+        } else if (node.status == 'skip') {
+            html += '<span class="status-skip"></span>';
+        }
+        url = node.url && node.url != 'None' ? node.url : '#';
+        html += '<a href="' + index_escape(url) + '"'
+            + (node.current ? ' class="index-current"' : '') + '>'
+            + index_escape(node.title) + '</a>';
+        if (row.search && search_sort == 'rmse' && node.rmse !== undefined) {
+            html += '<span class="index-duration">RMSE ' + node.rmse.toFixed(4) + '</span>';
+        } else if (node.duration !== undefined && node.duration !== null) {
+            html += '<span class="index-duration">' + index_format_duration(node.duration) + '</span>';
+        }
+        html += '</div>';
+    }
+    view.firstChild.innerHTML = html;
+};
+
+function index_toggle(node) {
+    if (node.expanded) {
+        node.expanded = false;
+        index_build_rows();
+        return;
+    }
+    index_load_chunk(node, function () {
+        node.expanded = true;
+        index_build_rows();
+    });
+};
+
+function index_click(event) {
+    var el = event.target;
+    while (el && el.className != 'index-row') {
+        el = el.parentElement;
+    }
+    if (!el) {
+        return;
+    }
+    var node = index_get_row(parseInt(el.dataset.row)).node;
+    if (index_has_childs(node)) {
+        event.preventDefault();
+        index_toggle(node);
+    }
+};
+
+function index_set_expanded(node, expanded) {
+    var i;
+    if (!node.childs) {
+        return;
+    }
+    node.expanded = expanded;
+    for (i = 0; i < node.childs.length; i++) {
+        index_set_expanded(node.childs[i], expanded);
+    }
+};
+
+function index_collapse_all() {
+    index_set_expanded(index, false);
+    index_build_rows();
+};
+
+function index_expend_all() {
+    var i;
+    for (i = 0; i < index.childs.length; i++) {
+        (function (node) {
+            index_load_chunk(node, function () {
+                index_set_expanded(node, true);
+                index_build_rows();
+            });
+        })(index.childs[i]);
+    }
+};
+
+function index_select_error() {
+    index_filter_errors = true;
+    index_build_rows();
+};
+
+function index_select_all() {
+    index_filter_errors = false;
+    index_build_rows();
+};
+
+function index_has_error() {
+    return index_is_error(index);
+};
+
+function index_reveal(name) {
+    // Expand the tree down to the test `name` and scroll to it.
+    var toks = name.split('.');
+    function walk(node, depth) {
+        var i, child = null;
+        for (i = 0; i < node.childs.length; i++) {
+            if (node.childs[i].title == toks[depth]) {
+                child = node.childs[i];
+                break;
+            }
+        }
+        if (child === null) {
+            return;
+        }
+        if (depth == toks.length - 1) {
+            if (index_current !== null) {
+                index_current.current = false;
+            }
+            index_current = child;
+            child.current = true;
+            if (index_filter_errors && !index_is_error(child)) {
+                index_filter_errors = false;
+            }
+            index_build_rows();
+            for (i = 0; i < index_rows.length; i++) {
+                if (index_rows[i].node === child) {
+                    var view = document.getElementById('index-tree-view');
+                    view.scrollTop = i * INDEX_ROW_HEIGHT - view.clientHeight / 2;
+                    break;
+                }
+            }
+            return;
+        }
+        index_load_chunk(child, function () {
+            child.expanded = true;
+            walk(child, depth + 1);
+        });
+    }
+    walk(index, 0);
+};
+
+function search_load(callback) {
+    // The search index is loaded on first search.
+    if (search_index !== null) {
+        callback();
+        return;
+    }
+    if (search_callbacks !== null) {
+        search_callbacks.push(callback);
+        return;
+    }
+    search_callbacks = [callback];
+    var script = document.createElement('script');
+    script.src = 'search.js';
+    document.head.appendChild(script);
+};
+
+function search_index_loaded(data) {
+    var callbacks = search_callbacks;
+    var offset = 0;
+    var i;
+    // Names are searched in one string, `offsets` being the start of each
+    // name.
+    data.text = data.names.join('\n').toLowerCase();
+    data.offsets = new Int32Array(data.names.length + 1);
+    for (i = 0; i < data.names.length; i++) {
+        data.offsets[i] = offset;
+        offset += data.names[i].length + 1;
+    }
+    data.offsets[data.names.length] = offset;
+    data.token_list = Object.keys(data.tokens);
+    data.orders = {};
+    search_index = data;
+    search_callbacks = null;
+    for (i = 0; i < callbacks.length; i++) {
+        callbacks[i]();
+    }
+};
+
+function search_has_page(id) {
+    return !search_index.pages || search_index.pages.charAt(id) == '1';
+};
+
+function search_node(id) {
+    var name = search_index.names[id];
+    return {
+        title: name,
+        url: search_has_page(id) ? search_index.urls[id] || name + '.html'
+            : detail_url(name),
+        status: search_status_names[parseInt(search_index.status.charAt(id))],
+        duration: search_index.durations[id],
+        rmse: search_index.rmse[id],
+        childs: []
+    };
+};
+
+function search_text_mask(word) {
+    // Mark tests whose name contains `word`, scanning all names.
+    var offsets = search_index.offsets;
+    var text = search_index.text;
+    var mask = new Uint8Array(search_index.names.length);
+    var pos = text.indexOf(word);
+    var id = 0;
+    while (pos >= 0) {
+        while (offsets[id + 1] <= pos) {
+            id++;
+        }
+        mask[id] = 1;
+        pos = text.indexOf(word, offsets[id + 1]);
+    }
+    return mask;
+};
+
+function search_word_mask(word) {
+    // Mark tests whose name contains `word`.
+    var tokens = search_index.token_list;
+    var mask, i, j, ids;
+    // A word without separator can only be found in one name token.
+    if (!/^[0-9a-z]+$/.test(word)) {
+        return search_text_mask(word);
+    }
+    for (i = 0; i < search_index.common.length; i++) {
+        if (search_index.common[i].indexOf(word) >= 0) {
+            return search_text_mask(word);
+        }
+    }
+    mask = new Uint8Array(search_index.names.length);
+    for (i = 0; i < tokens.length; i++) {
+        if (tokens[i].indexOf(word) >= 0) {
+            ids = search_index.tokens[tokens[i]];
+            for (j = 0; j < ids.length; j++) {
+                mask[ids[j]] = 1;
+            }
+        }
+    }
+    return mask;
+};
+
+function search_sort_order(column) {
+    // Ids of all tests by decreasing value of `column`, sorted once.
+    var values = search_index[column];
+    var order = search_index.orders[column];
+    var i;
+    if (!order) {
+        order = [];
+        for (i = 0; i < search_index.names.length; i++) {
+            order.push(i);
+        }
+        order.sort(function (a, b) {
+            return (values[b] || 0) - (values[a] || 0);
+        });
+        search_index.orders[column] = order;
+    }
+    return order;
+};
+
+function search_run() {
+    var words = document.getElementById('search-input').value.toLowerCase()
+        .split(/\s+/).filter(function (x) { return x.length > 0; });
+    var status = document.getElementById('search-status').value;
+    var sort = document.getElementById('search-sort').value;
+    search_sort = sort;
+    if (words.length == 0 && !status && !sort) {
+        index_search_results = null;
+        index_build_rows();
+        return;
+    }
+    search_load(function () {
+        var count = search_index.names.length;
+        var statuses = search_index.status;
+        var results = [];
+        var match = null;
+        var i, j, mask;
+        for (j = 0; j < words.length; j++) {
+            mask = search_word_mask(words[j]);
+            if (match === null) {
+                match = mask;
+            } else {
+                for (i = 0; i < count; i++) {
+                    match[i] &= mask[i];
+                }
+            }
+        }
+        var order = sort ? search_sort_order(sort) : null;
+        var id;
+        for (i = 0; i < count; i++) {
+            id = order === null ? i : order[i];
+            if ((match === null || match[id])
+                && (!status || status.indexOf(statuses.charAt(id)) >= 0)) {
+                results.push(id);
+            }
+        }
+        index_search_results = results;
+        document.getElementById('index-tree-view').scrollTop = 0;
+        index_build_rows();
+    });
+};
+
+function img_set_active(elts, image_type) {
+    var i;
+    for (i = 0; i < elts.length; i++) {
+        elt = elts[i];
+        if (elt.dataset.imageType == image_type) {
+            elt.classList.add('active');
+        } else {
+            elt.classList.remove('active');
+        }
+    }
+};
+
+function img_select(e) {
+    var grp = e,
+        image_type = e.dataset.imageType,
+        i;
+    while (!grp.classList.contains('img-grp')) {
+        grp = grp.parentElement;
+        if (grp == null) {
+            return;
+        }
+    }
+    img_set_active(grp.getElementsByClassName('img-btn'), image_type);
+    img_set_active(grp.getElementsByClassName('img-view'), image_type);
+};
+
+function setup() {
+    var view = document.getElementById('index-tree-view');
+    view.innerHTML = '<div class="index-rows"></div>';
+    view.onscroll = function () {
+        window.requestAnimationFrame(index_render);
+    };
+    view.onclick = index_click;
+    window.onresize = index_render;
+    if (index_has_error()) {
+        index_filter_errors = true;
+    }
+    index_build_rows();
+    if (typeof current_test !== 'undefined') {
+        index_reveal(current_test);
+    }
+    window.onhashchange = detail_show;
+    detail_show();
+};
+
+function detail_url(name) {
+    return 'index.html#' + encodeURIComponent(name);
+};
+
+function detail_show() {
+    // Generic detail view of the index page, for tests without page: the
+    // test is found by name in the search index.
+    var content = document.getElementById('detail-content');
+    if (!content) {
+        return;
+    }
+    var name = decodeURIComponent(window.location.hash.substring(1));
+    if (!name) {
+        content.style.display = 'none';
+        return;
+    }
+    index_reveal(name);
+    search_load(function () {
+        var id = search_index.names.indexOf(name);
+        if (id < 0) {
+            content.style.display = 'none';
+            return;
+        }
+        var node = search_node(id);
+        var html = '<p>' + index_escape(name) + '</p>'
+            + '<p><b>Status: </b>' + (status_titles[node.status] || 'unknow') + '</p>';
+        if (node.duration !== undefined && node.duration !== null) {
+            html += '<p><b>Duration: </b>' + node.duration.toFixed(3) + 's</p>';
+        }
+        if (node.rmse !== undefined) {
+            html += '<p><b>RMSE: </b>' + node.rmse.toFixed(4) + '</p>';
+        }
+        html += '<p class="detail-note">No detailed report for this test.</p>';
+        document.getElementById('detail-body').innerHTML = html;
+        content.style.display = 'block';
+        window.scrollTo(0, 0);
+    });
+};
+
+function timing_row(title, url, duration) {
+    var link = url ? '<a href="' + index_escape(url) + '">' + index_escape(title) + '</a>'
+        : index_escape(title);
+    return '<tr><td>' + link + '</td><td class="timing-duration">'
+        + index_format_duration(duration) + '</td></tr>';
+};
+
+function timing_module(name) {
+    // Module of the test `name`: its name without the test and the classes
+    // of the test, whose names are capitalized.
+    var toks = name.split('.');
+    toks.pop();
+    while (toks.length > 1 && /^[A-Z]/.test(toks[toks.length - 1])) {
+        toks.pop();
+    }
+    return toks.join('.');
+};
+
+function timing_toggle(link) {
+    var_toggle(link, 'timing-content');
+    timing_setup();
+    return false;
+};
+
+function timing_setup() {
+    // Timing tables of the index page, filled from the search index when
+    // first shown: slowest tests, and slowest modules by total duration.
+    var slowest = document.getElementById('timing-slowest');
+    var modules = document.getElementById('timing-modules');
+    if (!slowest || !modules || timing_loaded) {
+        return;
+    }
+    timing_loaded = true;
+    search_load(function () {
+        var order = search_sort_order('durations');
+        var durations = search_index.durations;
+        var totals = {};
+        var html = '';
+        var i, node, module;
+        for (i = 0; i < order.length && i < TIMING_SLOWEST; i++) {
+            node = search_node(order[i]);
+            if (node.duration === null || node.duration === undefined) {
+                break;
+            }
+            html += timing_row(node.title, node.url, node.duration);
+        }
+        slowest.innerHTML = html;
+        for (i = 0; i < search_index.names.length; i++) {
+            if (durations[i] !== null && durations[i] !== undefined) {
+                module = timing_module(search_index.names[i]);
+                totals[module] = (totals[module] || 0) + durations[i];
+            }
+        }
+        html = '';
+        Object.keys(totals).sort(function (a, b) {
+            return totals[b] - totals[a];
+        }).slice(0, TIMING_SLOWEST).forEach(function (module) {
+            html += timing_row(module, null, totals[module]);
+        });
+        modules.innerHTML = html;
+    });
+};
@@ -26,15 +26,21 @@ setup(
     },
     package_data={
         "html_test_report": [
+            "templates/report.css",
+            "templates/report.js",
             "templates/test-case.html",
         ]
     },
     install_requires=[
+        'futures; python_version < "3"',
         "jinja2",
         "pygments",
         "python-magic",
         "six",
     ],
+    extras_require={
+        "numpy": ["numpy", "Pillow"],
+    },
     classifiers=[
         "Development Status :: 4 - Beta",
         "Programming Language :: Python :: 2.7",
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import pytest
+
+pytest_plugins = "pytester"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def html_pytester(pytester, monkeypatch):
+    """
+    Pytester running pytest in a subprocess with the html test plugin
+    importable.
+    """
+    path = os.environ.get("PYTHONPATH")
+    monkeypatch.setenv(
+        "PYTHONPATH", ROOT + (os.pathsep + path if path else ""))
+    return pytester
+
+
+def search_index(path):
+    """
+    Return the data of the search index file `path`.
+    """
+    data = path.read_text()
+    prefix = "search_index_loaded("
+    assert data.startswith(prefix)
+    return json.loads(data[len(prefix):-len(");")])
+
+
+@pytest.fixture
+def read_search_index():
+    """
+    Function returning the data of a search index file.
+    """
+    return search_index
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+
+def test_xdist_shard_written_first(html_pytester, read_search_index):
+    """
+    Xdist workers write their shard before telling the controller they are
+    finished, so that it is merged in the report.
+    """
+    pytest.importorskip("xdist")
+    html_pytester.makeconftest(
+        """
+        import os
+        from html_test_report.report import TestIndexRoot
+
+        finished = []
+        write_shard = TestIndexRoot.write_shard
+
+        def check_write_shard(self):
+            if finished:
+                open("late-shard-%s" % os.getpid(), "w").close()
+            write_shard(self)
+
+        TestIndexRoot.write_shard = check_write_shard
+
+        def pytest_sessionstart(session):
+            # The xdist worker interactor, sending events to the controller.
+            for plugin in session.config.pluginmanager.get_plugins():
+                if type(plugin).__name__ == "WorkerInteractor":
+                    sendevent = plugin.sendevent
+
+                    def record_sendevent(name, **kwargs):
+                        if name == "workerfinished":
+                            finished.append(True)
+                        sendevent(name, **kwargs)
+
+                    plugin.sendevent = record_sendevent
+        """
+    )
+    html_pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.parametrize("i", range(4))
+        def test_ok(i):
+            pass
+
+        def test_fail():
+            assert False
+        """
+    )
+    result = html_pytester.runpytest_subprocess(
+        "-p", "html_test_report.pytest_plugin", "--with-html-test",
+        "--html-test-path=html", "-n", "2",
+    )
+    result.assert_outcomes(passed=4, failed=1)
+    assert not list(html_pytester.path.glob("late-shard-*"))
+    search = read_search_index(html_pytester.path / "html" / "search.js")
+    assert len(search["names"]) == 5
+
+
+def test_process_workers_stats(html_pytester):
+    """
+    Statistics of pages rendered by worker processes are in the report, its
+    summary being shown by the terminal reporter.
+    """
+    html_pytester.makepyfile(
+        """
+        def test_fail():
+            assert False
+        """
+    )
+    result = html_pytester.runpytest_subprocess(
+        "-p", "html_test_report.pytest_plugin", "--with-html-test",
+        "--html-test-path=html", "--html-test-workers=2",
+        "--html-test-worker-type=process",
+    )
+    result.assert_outcomes(failed=1)
+    result.stdout.re_match_lines([r"^html report: .*, [0-9.]+ MB written$"])
+    data = json.loads(
+        (html_pytester.path / "html" / "report-stats.json").read_text())
+    assert data["phases"]["render"]["calls"] == 1
+    assert data["phases"]["render"]["bytes"] > 0
+    assert data["phases"]["highlight"]["calls"] > 0
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import codecs
+import importlib
+import json
+import sys
+import tracemalloc
+
+from html_test_report import report
+from html_test_report.report import FrameSnapshot
+from html_test_report.report import TracebackHandler
+from html_test_report.report import TracebackOptions
+
+
+def failing_frame(tmp_path, monkeypatch, name, lines, options=None):
+    """
+    Import the module `name` of source `lines`, call its `fail` function and
+    return the snapshot of its frame.
+    """
+    tmp_path.joinpath(name + ".py").write_text(u"\n".join(lines))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = importlib.import_module(name)
+    try:
+        module.fail()
+    except ValueError:
+        handler = TracebackHandler(sys.exc_info(), options)
+    return list(handler[0])[-1]
+
+
+def highlighted_line(frame):
+    return [line.code for line in frame.code_fragment if line.highlight][0]
+
+
+FAIL = [u"", u"", u"def fail():", u"    value = 1", u"    raise ValueError(value)", u""]
+
+
+def test_window_resync_outside_string(tmp_path, monkeypatch):
+    """
+    Statement like lines of a multi-line string are not used to start the
+    highlighted window.
+    """
+    lines = (
+        [u'"""', u"Module doc."]
+        + [u"x = %d" % i for i in range(60)]
+        + [u'"""'] + FAIL
+    )
+    frame = failing_frame(tmp_path, monkeypatch, "docstring_module", lines)
+    code = highlighted_line(frame)
+    assert '<span class="k">raise</span>' in code
+    assert 'class="s2"' not in code
+
+
+def test_window_resync_class_body(tmp_path, monkeypatch):
+    """
+    A window starting inside a docstring of a long class body is highlighted
+    from the class statement.
+    """
+    lines = (
+        [u"class Long(object):"]
+        + [u"    def method_%d(self): return %d" % (i, i) for i in range(120)]
+        + [u"    def doc(self):", u'        """']
+        + [u"        x = %d" % i for i in range(60)]
+        + [u"    y = 0", u'        """',
+           u"    def fail(self):",
+           u"        value = 1",
+           u"        raise ValueError(value)",
+           u"    def after(self):",
+           u'        """After."""',
+           u"def fail():",
+           u"    Long().fail()"]
+    )
+    frame = failing_frame(tmp_path, monkeypatch, "class_module", lines)
+    _, window, _ = frame.get_code_window()
+    assert window.first == 1
+    code = highlighted_line(frame)
+    assert '<span class="k">raise</span>' in code
+    assert 'class="s' not in code
+
+
+def test_window_resync(tmp_path, monkeypatch):
+    """
+    Only a window around the frame line is highlighted.
+    """
+    lines = [u"x_%d = %d" % (i, i) for i in range(200)] + FAIL
+    frame = failing_frame(tmp_path, monkeypatch, "long_module", lines)
+    _, window, _ = frame.get_code_window()
+    assert window.first > 100
+    assert '<span class="k">raise</span>' in highlighted_line(frame)
+
+
+def test_frame_data_fragment(tmp_path, monkeypatch):
+    """
+    Data of a frame only has the source lines needed to highlight the lines
+    shown, not the whole source file.
+    """
+    lines = [u"x_%d = %d" % (i, i) for i in range(500)] + FAIL
+    options = TracebackOptions(windowed=False)
+    frame = failing_frame(tmp_path, monkeypatch, "full_module", lines, options)
+    data = json.loads(json.dumps(frame.to_dict()))
+    _, (first, fragment), _ = data["code_window"]
+    assert first == frame.lineno - options.fragment_length
+    # The frame line is the last line of the file.
+    assert first + len(fragment) - 1 == frame.lineno
+    loaded = FrameSnapshot.from_dict(data, options)
+    assert list(loaded.code_fragment) == list(frame.code_fragment)
+
+
+def test_streaming_index_rerun(tmp_path):
+    """
+    A test added again to a streaming index is counted once, with its last
+    status.
+    """
+    index = report.TestIndexRoot(tmp_path / "html", streaming_index=True)
+    index.add("mod.Class.test_a", "fail", "mod.Class.test_a.html", keep_leaf=False)
+    index.add("mod.Class.test_b", "success", "mod.Class.test_b.html",
+              keep_leaf=False)
+    index.add("mod.Class.test_a", "success", "mod.Class.test_a.html",
+              keep_leaf=False)
+    counts = index.get_counts()
+    assert counts["success"] == 2
+    assert counts["fail"] == 0
+    assert index["mod"]["Class"].get_counts() == counts
+
+
+def test_streaming_index_recent_statuses(tmp_path):
+    """
+    Only the status of the last tests of a streaming index is kept.
+    """
+    index = report.TestIndexRoot(tmp_path / "html", streaming_index=True)
+    for i in range(3000):
+        index.add("mod.test_%d" % i, "success", "mod.test_%d.html" % i,
+                  keep_leaf=False)
+    assert len(index._statuses) == index.max_recent_statuses
+    assert index.get_counts()["success"] == 3000
+
+
+def write_search_index(path, records, chunk_size):
+    with codecs.open(str(path), "w", encoding="utf-8") as outfile:
+        search = report.SearchIndexWriter(outfile, str(path.parent), chunk_size)
+        for record in records:
+            search.add(*record)
+        search.close()
+
+
+def test_search_index(tmp_path, read_search_index):
+    """
+    Tokens sorted by chunks are merged, tokens of most tests being left out.
+    """
+    records = [
+        ("pkg.mod%d.test_%d" % (i % 3, i), "fail" if i % 5 else "success",
+         "pkg.mod%d.test_%d.html" % (i % 3, i), {"duration": 0.5})
+        for i in range(10000)
+    ]
+    records[1] = records[1][:2] + (report.detail_url(records[1][0]), {})
+    records[2] = records[2][:2] + ("other.html", {"rmse": 0.25})
+    path = tmp_path / "search.js"
+    write_search_index(path, records, chunk_size=1000)
+    search = read_search_index(path)
+    assert search["names"] == [x[0] for x in records]
+    assert search["status"] == "".join(
+        "1" if i % 5 else "3" for i in range(10000))
+    assert search["durations"][:3] == [0.5, None, None]
+    assert search["urls"] == {"2": "other.html"}
+    assert search["pages"] == "1" + "0" + "1" * 9998
+    assert search["rmse"] == {"2": 0.25}
+    assert sorted(search["common"]) == ["mod0", "mod1", "mod2", "pkg", "test"]
+    assert search["tokens"]["42"] == [42]
+
+
+def test_search_index_memory(tmp_path, read_search_index):
+    """
+    Memory of the search index does not grow with the number of tests.
+    """
+    records = (
+        ("pkg%d.mod%d.Class%d.test_%d" % (i % 5, i % 50, i % 500, i),
+         "success", "pkg%d.mod%d.Class%d.test_%d.html" % (i % 5, i % 50, i % 500, i),
+         {"duration": 0.001 * (i % 13)})
+        for i in range(50000)
+    )
+    tracemalloc.start()
+    try:
+        write_search_index(tmp_path / "search.js", records, chunk_size=10000)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 4 * 1024 * 1024
+    assert len(read_search_index(tmp_path / "search.js")["names"]) == 50000